@@ -0,0 +1,275 @@
+import re
+import time
+import random
+import asyncio
+from collections import Counter, defaultdict
+from uuid import uuid4
+
+from aiohttp import web
+
+
+# Локальные заменители Supabase (PostgREST), Telegram Bot API и CryptoCloud.
+# Держат данные в памяти и умеют имитировать сетевую задержку.
+
+PRIMARY_KEYS = {"users": "id", "tariffs": "id", "subscriptions": "id", "invoices": "id", "processed_events": "id", "http_logs": None}
+
+
+async def _delay(latency: float, jitter: float):
+    if latency > 0:
+        await asyncio.sleep(max(0.0, random.gauss(latency, latency * jitter)))
+
+
+async def start_site(app: web.Application, host: str = "127.0.0.1"):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+# --- POSTGREST ---
+def _compare(value, literal: str):
+    # Сравнение "как в Postgres" для того, что реально приходит из postgrest-py
+    if isinstance(value, bool):
+        value, literal = str(value).lower(), literal.lower()
+    if value is None:
+        return None
+    try:
+        a, b = float(value), float(literal)
+    except (TypeError, ValueError):
+        a, b = str(value), literal
+    return (a > b) - (a < b)
+
+
+def _unquote(literal: str) -> str:
+    if len(literal) >= 2 and literal[0] == literal[-1] == '"':
+        return literal[1:-1]
+    return literal
+
+
+def _match(row: dict, column: str, expr: str) -> bool:
+    op, _, literal = expr.partition(".")
+    value = row.get(column)
+    if op == "in":
+        items = [_unquote(item) for item in literal.strip("()").split(",") if item]
+        return any(_compare(value, item) == 0 for item in items)
+    if op == "is":
+        return value is None if literal == "null" else _compare(value, literal) == 0
+    cmp = _compare(value, _unquote(literal))
+    if cmp is None:
+        return False
+    return {
+        "eq": cmp == 0, "neq": cmp != 0,
+        "gt": cmp > 0, "gte": cmp >= 0,
+        "lt": cmp < 0, "lte": cmp <= 0,
+    }.get(op, False)
+
+
+def _split_top(value: str) -> list:
+    # "a.eq.1,and(b.eq.2,c.gt.3)" -> ["a.eq.1", "and(b.eq.2,c.gt.3)"] с учётом скобок и кавычек
+    parts, depth, quoted, current = [], 0, False, ""
+    for ch in value:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _match_logic(row: dict, mode: str, expr: str) -> bool:
+    results = []
+    for part in _split_top(expr.strip()[1:-1]):
+        nested = re.match(r"^(and|or)(\(.*\))$", part)
+        if nested:
+            results.append(_match_logic(row, nested.group(1), nested.group(2)))
+        else:
+            column, _, rest = part.partition(".")
+            results.append(_match(row, column, rest))
+    return all(results) if mode == "and" else any(results)
+
+
+class FakePostgrest:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.tables = defaultdict(list)
+        self.calls = Counter()
+
+    def seed(self, table: str, rows: list):
+        self.tables[table].extend(dict(row) for row in rows)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/rest/v1/{table}", self.handle)
+        return app
+
+    def _filter(self, table: str, query) -> list:
+        rows = self.tables[table]
+        for column, expr in query.items():
+            if column in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if column in ("or", "and"):
+                rows = [row for row in rows if _match_logic(row, column, expr)]
+            else:
+                rows = [row for row in rows if _match(row, column, expr)]
+        return rows
+
+    @staticmethod
+    def _order(rows: list, order: str) -> list:
+        for item in reversed(order.split(",")):
+            column, _, direction = item.partition(".")
+            rows = sorted(rows, key=lambda r: (r.get(column) is None, str(r.get(column))),
+                          reverse=direction.startswith("desc"))
+        return rows
+
+    async def handle(self, request: web.Request):
+        table = request.match_info["table"]
+        self.calls[f"{request.method} {table}"] += 1
+        await _delay(self.latency, self.jitter)
+
+        prefer = request.headers.get("Prefer", "")
+        query = request.query
+        if request.method == "GET":
+            rows = self._filter(table, query)
+            if "order" in query:
+                rows = self._order(rows, query["order"])
+            if "limit" in query:
+                rows = rows[:int(query["limit"])]
+            return web.json_response(rows)
+
+        if request.method == "POST":
+            body = await request.json()
+            items = body if isinstance(body, list) else [body]
+            key = query.get("on_conflict") or PRIMARY_KEYS.get(table)
+            written = []
+            for item in items:
+                existing = None
+                if key and item.get(key) is not None:
+                    existing = next((row for row in self.tables[table] if str(row.get(key)) == str(item[key])), None)
+                if existing is not None:
+                    if "resolution=merge-duplicates" in prefer:
+                        existing.update(item)
+                        written.append(existing)
+                    elif "resolution=ignore-duplicates" not in prefer:
+                        return web.json_response({"code": "23505", "message": "duplicate key"}, status=409)
+                    continue
+                row = dict(item)
+                self.tables[table].append(row)
+                written.append(row)
+            if "return=minimal" in prefer:
+                return web.Response(status=201)
+            return web.json_response(written, status=201)
+
+        if request.method == "PATCH":
+            changes = await request.json()
+            rows = self._filter(table, query)
+            for row in rows:
+                row.update(changes)
+            if "return=minimal" in prefer:
+                return web.Response(status=204)
+            return web.json_response(rows)
+
+        if request.method == "DELETE":
+            rows = self._filter(table, query)
+            self.tables[table] = [row for row in self.tables[table] if row not in rows]
+            return web.json_response(rows)
+
+        return web.json_response({"message": "Method not allowed"}, status=405)
+
+
+# --- TELEGRAM BOT API ---
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self.webhook_url = ""
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def _message(self, chat_id, text: str = "") -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "channel"},
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        await _delay(self.latency, self.jitter)
+
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method in ("sendMessage", "editMessageText"):
+            result = self._message(params.get("chat_id") or 1, params.get("text", ""))
+        elif method in ("createChatInviteLink", "revokeChatInviteLink"):
+            result = {
+                "invite_link": params.get("invite_link") or f"https://t.me/+{uuid4().hex[:16]}",
+                "creator": {"id": 1, "is_bot": True, "first_name": "bench"},
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": method == "revokeChatInviteLink",
+            }
+        elif method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            result = True
+        elif method == "getWebhookInfo":
+            result = {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        else:
+            # setWebhook, answerCallbackQuery, banChatMember, ... — достаточно True
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+# --- CRYPTOCLOUD ---
+class FakeCryptoCloud:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self.orders = []  # order_id созданных счетов — по ним генерируем вебхуки об оплате
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v2/invoice/create", self.create_invoice)
+        return app
+
+    async def create_invoice(self, request: web.Request):
+        self.calls["invoice/create"] += 1
+        await _delay(self.latency, self.jitter)
+        data = await request.json()
+        invoice_id = uuid4().hex[:8].upper()
+        self.orders.append(data["order_id"])
+        return web.json_response({
+            "status": "success",
+            "result": {
+                "uuid": f"INV-{invoice_id}",
+                "link": f"https://pay.cryptocloud.plus/{invoice_id}",
+                "amount": data["amount"],
+                "currency": data.get("currency", "USD"),
+                "order_id": data["order_id"],
+            },
+        })
+
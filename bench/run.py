@@ -0,0 +1,330 @@
+# Офлайн-нагрузочный тест бота: Supabase, Telegram и CryptoCloud заменены локальными фейками.
+#
+#   python -m bench.run --users 200 --requests 2000 --concurrency 50
+#   python -m bench.run --json results.json
+#   python -m bench.run --compare results.json --tolerance 0.25   # exit 1 при регрессии p95
+#
+# Запускать из корня репозитория: main.py импортируется после подмены переменных окружения.
+# Лимиты Telegram (TELEGRAM_GLOBAL_RATE и др.) действуют и здесь; чтобы мерить только код,
+#   TELEGRAM_GLOBAL_RATE=100000 TELEGRAM_GLOBAL_BURST=100000 TELEGRAM_CHAT_BURST=100 python -m bench.run
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import importlib
+import contextlib
+from collections import Counter
+
+import aiohttp
+
+from bench import traffic
+from bench.fakes import FakePostgrest, FakeTelegram, FakeCryptoCloud, start_site
+
+
+BENCH_TOKEN = "4242:BENCH-token"
+TRIBUTE_SECRET = "bench-secret"
+FIRST_USER_ID = 700_000_000
+
+
+# --- STATS ---
+def percentile(values: list, q: float) -> float:
+    # nearest-rank по отсортированному списку
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = Counter()
+        self.wall = {}
+
+    async def run(self, name: str, items: list, call, concurrency: int):
+        samples = self.samples.setdefault(name, [])
+        queue = list(reversed(items))
+
+        async def worker():
+            while queue:
+                item = queue.pop()
+                started = time.perf_counter()
+                try:
+                    await call(item)
+                except Exception as e:
+                    self.errors[name] += 1
+                    print(f"❌ {name}: {type(e).__name__}: {e}", file=sys.__stderr__)
+                samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(items)) or 1)))
+        self.wall[name] = self.wall.get(name, 0.0) + time.perf_counter() - started
+
+    def results(self) -> dict:
+        results = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            wall = self.wall.get(name) or 1e-9
+            results[name] = {
+                "count": len(ordered),
+                "errors": self.errors[name],
+                "rps": round(len(ordered) / wall, 1),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+                "max_ms": round((ordered[-1] if ordered else 0) * 1000, 2),
+            }
+        return results
+
+
+def format_table(results: dict) -> str:
+    header = f"{'endpoint':<34} {'count':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    lines = [header, "-" * len(header)]
+    for name, r in results.items():
+        lines.append(
+            f"{name:<34} {r['count']:>7} {r['errors']:>5} {r['rps']:>9} "
+            f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("p95_ms"):
+            continue
+        if r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} ms -> {r['p95_ms']} ms")
+    return regressions
+
+
+# --- ENVIRONMENT ---
+def configure_env(postgrest_url: str, telegram_url: str, cryptocloud_url: str, workdir: str):
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "SUPABASE_URL": postgrest_url,
+        "SUPABASE_KEY": "bench",
+        "TELEGRAM_API_URL": telegram_url,
+        "CRYPTOCLOUD_API_URL": f"{cryptocloud_url}/v2",
+        "CRYPTOCLOUD_API_KEY": "bench",
+        "CRYPTOCLOUD_SHOP_ID": "bench",
+        "TRIBUTE_API_SECRET": TRIBUTE_SECRET,
+        "WEBHOOK_URL": "http://bench.invalid/webhook",
+        "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "REPLICA_URLS": "",
+    })
+    # Остальные настройки (пулы, размеры очередей, ...) можно задать снаружи как обычно
+    os.environ.setdefault("JOB_RETRY_DELAY", "0.2")
+    os.environ.setdefault("NOTIFICATION_MIN_INTERVAL", "0")
+
+
+async def wait_idle(bot_app, timeout: float):
+    # Ждём, пока очередь апдейтов, фоновые апдейты aiogram (если вебхук обходит очередь) и очередь заданий разберутся
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # users — полосы в очереди или в обработке
+        feeding = bot_app.updates.stats()["users"] or [
+            task for task in asyncio.all_tasks()
+            if "_background_feed_update" in getattr(task.get_coro(), "__qualname__", "")
+        ]
+        stats = await bot_app.jobs.stats()
+        if not feeding and stats["pending"] == 0 and stats["running"] == 0:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+# --- SCENARIO ---
+async def run(args) -> dict:
+    random.seed(args.seed)
+    postgrest = FakePostgrest(args.db_latency / 1000)
+    telegram = FakeTelegram(args.telegram_latency / 1000)
+    cryptocloud = FakeCryptoCloud(args.cryptocloud_latency / 1000)
+
+    tariffs = traffic.make_tariffs(args.channels, args.plans)
+    postgrest.seed("tariffs", tariffs)
+
+    runners, urls = [], []
+    for fake in (postgrest, telegram, cryptocloud):
+        runner, url = await start_site(fake.app())
+        runners.append(runner)
+        urls.append(url)
+
+    workdir = tempfile.mkdtemp(prefix="ofbot-bench-")
+    configure_env(*urls, workdir)
+    bot_app = importlib.import_module("main")
+    from aiogram.types import Update
+
+    app_runner, app_url = await start_site(bot_app.app)
+    session = aiohttp.ClientSession()
+    recorder = Recorder()
+
+    users = [FIRST_USER_ID + i for i in range(args.users)]
+    user_channel = {user_id: f"chan{random.randrange(args.channels)}" for user_id in users}
+    channel_tariffs = {}
+    for tariff in tariffs:
+        channel_tariffs.setdefault(tariff["channel_name"], []).append(tariff)
+
+    def pick_tariff(user_id: int) -> dict:
+        return random.choice(channel_tariffs[user_channel[user_id]])
+
+    async def feed(update: dict):
+        await bot_app.dp.feed_update(bot_app.bot, Update.model_validate(update, context={"bot": bot_app.bot}))
+
+    async def post_webhook(update: dict):
+        async with session.post(f"{app_url}/webhook", json=update) as resp:
+            await resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP {resp.status}")
+
+    async def post_cryptocloud(form: dict):
+        async with session.post(f"{app_url}/webhook/cryptocloud", data=form) as resp:
+            await resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP {resp.status}")
+
+    async def post_tribute(request: tuple):
+        body, headers = request
+        async with session.post(f"{app_url}/webhook/tribute", data=body, headers=headers) as resp:
+            await resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP {resp.status}")
+
+    async def wait_ready(timeout: float = 30):
+        # Трафик пускаем, как балансировщик: только после 200 на /readyz
+        deadline = time.monotonic() + timeout
+        while True:
+            async with session.get(f"{app_url}/readyz") as resp:
+                if resp.status == 200:
+                    return
+                checks = await resp.json()
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"App not ready: {checks}")
+            await asyncio.sleep(0.1)
+
+    await wait_ready()
+
+    def sample_users(n: int) -> list:
+        return [random.choice(users) for _ in range(n)]
+
+    n = args.requests
+    c = args.concurrency
+    try:
+        await recorder.run("update /start (new user)",
+                           [traffic.start_update(u, user_channel[u]) for u in users], feed, c)
+        await recorder.run("update /start (returning)",
+                           [traffic.start_update(u, user_channel[u]) for u in sample_users(n)], feed, c)
+        await recorder.run("callback plan_",
+                           [traffic.plan_update(u, pick_tariff(u)["id"]) for u in sample_users(n)], feed, c)
+        await recorder.run("callback pay_crypto_",
+                           [traffic.pay_crypto_update(u, pick_tariff(u)["id"]) for u in sample_users(n)], feed, c)
+        await recorder.run("POST /webhook",
+                           [traffic.start_update(u, user_channel[u]) for u in sample_users(n)], post_webhook, c)
+
+        # Оплаты: каждый созданный счёт + повторные доставки + промежуточные статусы
+        orders = list(cryptocloud.orders)
+        forms = [traffic.cryptocloud_webhook(order_id) for order_id in orders]
+        forms += [traffic.cryptocloud_webhook(order_id) for order_id in random.sample(orders, int(len(orders) * args.duplicates))]
+        forms += [traffic.cryptocloud_webhook(order_id, status="created") for order_id in orders[: len(orders) // 10]]
+        random.shuffle(forms)
+
+        tribute = []
+        for i, user_id in enumerate(sample_users(n)):
+            tribute.append(traffic.tribute_webhook(user_id, pick_tariff(user_id), 900_000 + i, TRIBUTE_SECRET))
+        tribute += random.sample(tribute, int(len(tribute) * args.duplicates))
+
+        drain_started = time.perf_counter()
+        await recorder.run("POST /webhook/cryptocloud", forms, post_cryptocloud, c)
+        await recorder.run("POST /webhook/tribute", tribute, post_tribute, c)
+        idle = await wait_idle(bot_app, args.drain_timeout)
+        drain = time.perf_counter() - drain_started
+    finally:
+        await session.close()
+        await app_runner.cleanup()
+        for runner in runners:
+            await runner.cleanup()
+
+    return {
+        "endpoints": recorder.results(),
+        "jobs": {
+            "completed": bot_app.jobs.completed,
+            "retried": bot_app.jobs.retried,
+            "failed": bot_app.jobs.failed,
+            "drain_seconds": round(drain, 3),
+            "drained": idle,
+        },
+        "updates": bot_app.updates.stats(),
+        "upstream_calls": {
+            "postgrest": dict(postgrest.calls),
+            "telegram": dict(telegram.calls),
+            "cryptocloud": dict(cryptocloud.calls),
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the bot with local stand-ins")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000, help="updates per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--plans", type=int, default=3, help="tariffs per channel")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of re-delivered webhooks")
+    parser.add_argument("--db-latency", type=float, default=5, help="ms")
+    parser.add_argument("--telegram-latency", type=float, default=20, help="ms")
+    parser.add_argument("--cryptocloud-latency", type=float, default=100, help="ms")
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="baseline JSON from a previous --json run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth vs baseline")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with output:
+        results = asyncio.run(run(args))
+
+    print(format_table(results["endpoints"]))
+    print()
+    jobs = results["jobs"]
+    print(f"jobs: completed={jobs['completed']} retried={jobs['retried']} failed={jobs['failed']} "
+          f"drain={jobs['drain_seconds']}s{'' if jobs['drained'] else ' (timed out)'}")
+    updates = results["updates"]
+    print("updates: " + ", ".join(f"{name}={updates[name]}" for name in ("accepted", "processed", "shed", "rejected", "failed")))
+    for upstream, calls in results["upstream_calls"].items():
+        print(f"{upstream}: " + ", ".join(f"{name}={value}" for name, value in sorted(calls.items())))
+
+    # Каждый принятый POST /webhook должен пройти через UpdateQueue, а не мимо неё
+    webhook = results["endpoints"].get("POST /webhook")
+    if webhook and updates["accepted"] + updates["shed"] < webhook["count"] - webhook["errors"]:
+        print(f"\n❌ /webhook bypassed the update queue: {webhook['count'] - webhook['errors']} posted, "
+              f"{updates['accepted'] + updates['shed']} queued")
+        return 1
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+        regressions = compare(results["endpoints"], baseline, args.tolerance)
+        if regressions:
+            print("\n❌ p95 regressions:\n" + "\n".join(regressions))
+            return 1
+        print("\n✅ No p95 regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
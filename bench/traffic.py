@@ -0,0 +1,103 @@
+import hmac
+import json
+import time
+import random
+import hashlib
+from datetime import datetime, timezone, timedelta
+from itertools import count
+
+
+# Синтетические данные и трафик: тарифы, апдейты Telegram, вебхуки CryptoCloud/Tribute
+
+_update_ids = count(1)
+
+
+def make_tariffs(channels: int = 4, per_channel: int = 3) -> list:
+    tariffs = []
+    for c in range(channels):
+        for p in range(per_channel):
+            tariff_id = str(1000 + c * per_channel + p)
+            tariffs.append({
+                "id": tariff_id,
+                "title": f"Bench {c}-{p}",
+                "category": "of",
+                "channel_name": f"chan{c}",
+                "channel_id": -1001000000000 - c,
+                "price": 5 + 5 * p,
+                "currency": "USD",
+                "lifetime": 1440 * 30 * (p + 1),
+                "is_active": True,
+                "tribute_link": f"https://t.me/tribute/app?startapp=bench{tariff_id}",
+                "short_description": "Synthetic plan",
+                "description": "Generated by bench/",
+            })
+    return tariffs
+
+
+def _user(user_id: int, lang: str) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": lang}
+
+
+def _message(user_id: int, text: str, lang: str) -> dict:
+    return {
+        "message_id": random.randint(1, 2 ** 31),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id, lang),
+        "text": text,
+    }
+
+
+def start_update(user_id: int, channel_name: str, lang: str = "en") -> dict:
+    # /start с deep link вида of_<channel_name>
+    return {"update_id": next(_update_ids), "message": _message(user_id, f"/start of_{channel_name}", lang)}
+
+
+def callback_update(user_id: int, data: str, lang: str = "en") -> dict:
+    bot_message = _message(user_id, "Choose plan 👇", lang)
+    bot_message["from"] = {"id": 1, "is_bot": True, "first_name": "bench"}
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(random.randint(1, 2 ** 63)),
+            "from": _user(user_id, lang),
+            "chat_instance": str(user_id),
+            "message": bot_message,
+            "data": data,
+        },
+    }
+
+
+def plan_update(user_id: int, tariff_id: str, lang: str = "en") -> dict:
+    return callback_update(user_id, f"plan_{tariff_id}", lang)
+
+
+def pay_crypto_update(user_id: int, tariff_id: str, lang: str = "en") -> dict:
+    return callback_update(user_id, f"pay_crypto_{tariff_id}", lang)
+
+
+def cryptocloud_webhook(order_id: str, status: str = "success") -> dict:
+    # CryptoCloud шлёт form-data
+    return {"status": status, "order_id": order_id, "invoice_id": f"INV-{order_id[-8:]}", "token": "bench"}
+
+
+def tribute_webhook(user_id: int, tariff: dict, subscription_id: int, secret: str = None):
+    expires_at = (datetime.now(timezone.utc) + timedelta(days=30)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    body = json.dumps({
+        "name": "new_subscription",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "sent_at": datetime.now(timezone.utc).isoformat(),
+        "payload": {
+            "subscription_id": subscription_id,
+            "subscription_name": tariff["title"],
+            "telegram_user_id": user_id,
+            "price": tariff["price"],
+            "amount": tariff["price"],
+            "currency": "usd",
+            "expires_at": expires_at,
+        },
+    }).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["trbt-signature"] = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return body, headers
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+from outbound import send_priority, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+BROADCAST_DB_PATH = os.getenv("BROADCAST_DB_PATH", "broadcasts.sqlite3")
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 10))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", 200))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", 5))
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    cursor TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    delivered INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_error TEXT
+);
+"""
+
+COLUMNS = ("id", "kind", "params", "cursor", "status", "delivered", "failed", "created_at", "updated_at", "last_error")
+
+
+class BroadcastEngine:
+    # Рассылки по аудитории, которая читается страницами (keyset) через зарегистрированную функцию.
+    # После каждой страницы курсор и счётчики сохраняются в SQLite — после рестарта продолжаем с него.
+
+    def __init__(
+        self,
+        bot,
+        path: str = BROADCAST_DB_PATH,
+        workers: int = BROADCAST_WORKERS,
+        page_size: int = BROADCAST_PAGE_SIZE,
+        poll_interval: float = BROADCAST_POLL_INTERVAL,
+    ):
+        self.bot = bot
+        self.path = path
+        self.workers = workers
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+
+        # kind -> async audience(params, cursor, limit) -> (messages, next_cursor)
+        self.audiences = {}
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcasts-sqlite")
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def register(self, kind: str, audience):
+        self.audiences[kind] = audience
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # --- SQLITE (выполняется в потоке executor'а) ---
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    def _insert(self, kind: str, params: str) -> int:
+        now = time.time()
+        cur = self._conn.execute(
+            "INSERT INTO broadcasts (kind, params, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (kind, params, now, now),
+        )
+        return cur.lastrowid
+
+    def _select(self, where: str = "", args=(), limit: int = 20) -> list:
+        rows = self._conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM broadcasts {where} ORDER BY id DESC LIMIT ?",
+            (*args, limit),
+        ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def _next(self):
+        # 'running' — рассылка, прерванная остановкой процесса
+        row = self._conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM broadcasts "
+            "WHERE status IN ('running', 'pending') ORDER BY status = 'pending', id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE broadcasts SET status = 'running' WHERE id = ?", (row[0],))
+        return dict(zip(COLUMNS, row))
+
+    def _checkpoint(self, broadcast_id: int, cursor: str, delivered: int, failed: int):
+        self._conn.execute(
+            "UPDATE broadcasts SET cursor = ?, delivered = delivered + ?, failed = failed + ?, updated_at = ? "
+            "WHERE id = ?",
+            (cursor, delivered, failed, time.time(), broadcast_id),
+        )
+
+    def _finish(self, broadcast_id: int, status: str, error: str = None):
+        # Отменённую рассылку не перетираем статусом done
+        self._conn.execute(
+            "UPDATE broadcasts SET status = ?, last_error = ?, updated_at = ? WHERE id = ? AND status != 'cancelled'",
+            (status, error, time.time(), broadcast_id),
+        )
+
+    def _cancel(self, broadcast_id: int) -> bool:
+        cur = self._conn.execute(
+            "UPDATE broadcasts SET status = 'cancelled', updated_at = ? "
+            "WHERE id = ? AND status IN ('pending', 'running')",
+            (time.time(), broadcast_id),
+        )
+        return cur.rowcount > 0
+
+    def _status(self, broadcast_id: int):
+        row = self._conn.execute("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return row[0] if row else None
+
+    # --- API ---
+    async def create(self, kind: str, params: dict) -> int:
+        if kind not in self.audiences:
+            raise ValueError(f"Unknown broadcast kind {kind!r}")
+        broadcast_id = await self._call(self._insert, kind, json.dumps(params))
+        self._wakeup.set()
+        return broadcast_id
+
+    async def get(self, broadcast_id: int):
+        rows = await self._call(self._select, "WHERE id = ?", (broadcast_id,), 1)
+        return self._public(rows[0]) if rows else None
+
+    async def list(self, limit: int = 20) -> list:
+        return [self._public(row) for row in await self._call(self._select, "", (), limit)]
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        return await self._call(self._cancel, broadcast_id)
+
+    @staticmethod
+    def _public(row: dict) -> dict:
+        row = dict(row)
+        row["params"] = json.loads(row["params"])
+        row["cursor"] = json.loads(row["cursor"]) if row["cursor"] else None
+        return row
+
+    async def start(self, run: bool = True):
+        # run=False — только API (create/list/cancel): рассылки выполняет другой процесс на том же файле
+        if self._conn is None:
+            await self._call(self._open)
+        if run and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Останавливает выполнение; create/list/cancel работают до close()
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def close(self):
+        await self.stop()
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+
+    # --- DELIVERY ---
+    async def _send(self, message: dict) -> bool:
+        try:
+            await self.bot.send_message(
+                chat_id=message["chat_id"],
+                text=message["text"],
+                reply_markup=message.get("reply_markup"),
+            )
+            return True
+        except (TelegramForbiddenError, TelegramBadRequest):
+            return False  # бот заблокирован или чат удалён — повторять бессмысленно
+        except Exception as e:
+            logger.error("❌ Broadcast send to %s failed: %s", message["chat_id"], e)
+            return False
+
+    async def _deliver(self, messages: list):
+        queue = deque(messages)
+        results = []
+
+        async def worker():
+            while queue:
+                results.append(await self._send(queue.popleft()))
+
+        # Лимиты Telegram держит OutboundScheduler; рассылка идёт с низшим приоритетом
+        with send_priority(PRIORITY_BULK):
+            await asyncio.gather(*(worker() for _ in range(min(self.workers, len(messages)))))
+        delivered = sum(results)
+        return delivered, len(results) - delivered
+
+    async def _execute(self, broadcast: dict):
+        broadcast_id = broadcast["id"]
+        audience = self.audiences.get(broadcast["kind"])
+        if audience is None:
+            await self._call(self._finish, broadcast_id, "failed", f"Unknown kind {broadcast['kind']!r}")
+            return
+        params = json.loads(broadcast["params"])
+        cursor = json.loads(broadcast["cursor"]) if broadcast["cursor"] else None
+        logger.info("📣 Broadcast %s (%s) %s", broadcast_id, broadcast["kind"], "resumed" if cursor else "started")
+
+        while not self._stopping:
+            if await self._call(self._status, broadcast_id) == "cancelled":
+                logger.info("🛑 Broadcast %s cancelled", broadcast_id)
+                return
+            messages, next_cursor = await audience(params, cursor, self.page_size)
+            delivered, failed = await self._deliver(messages)
+            await self._call(
+                self._checkpoint, broadcast_id,
+                json.dumps(next_cursor) if next_cursor is not None else broadcast["cursor"], delivered, failed,
+            )
+            if next_cursor is None:
+                await self._call(self._finish, broadcast_id, "done")
+                logger.info("✅ Broadcast %s finished", broadcast_id)
+                return
+            cursor = next_cursor
+            broadcast["cursor"] = json.dumps(cursor)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                broadcast = await self._call(self._next)
+                if broadcast is not None:
+                    try:
+                        await self._execute(broadcast)
+                    except Exception as e:
+                        logger.error("❌ Broadcast %s failed: %s", broadcast["id"], e)
+                        await self._call(self._finish, broadcast["id"], "failed", f"{type(e).__name__}: {e}")
+                    continue
+            except Exception as e:
+                logger.error("❌ Broadcast engine error: %s", e)
+
+            if self._stopping:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,427 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from scheduler import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+TARIFF_CACHE_TTL = float(os.getenv("TARIFF_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 50000))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", 86400))
+INVOICE_REUSE_TTL = float(os.getenv("INVOICE_REUSE_TTL", 3600))  # сколько секунд выдаём тот же счёт повторно
+INVOICE_CACHE_SIZE = int(os.getenv("INVOICE_CACHE_SIZE", 10000))
+SUBSCRIPTION_INDEX_RECONCILE_INTERVAL = float(os.getenv("SUBSCRIPTION_INDEX_RECONCILE_INTERVAL", 600))
+SUBSCRIPTION_INDEX_PAGE_SIZE = int(os.getenv("SUBSCRIPTION_INDEX_PAGE_SIZE", 1000))
+SUBSCRIPTION_INDEX_SYNC_INTERVAL = float(os.getenv("SUBSCRIPTION_INDEX_SYNC_INTERVAL", 5))
+SUBSCRIPTION_INDEX_SYNC_OVERLAP = float(os.getenv("SUBSCRIPTION_INDEX_SYNC_OVERLAP", 30))  # запас на медленные вставки
+
+
+# --- TARIFF CATALOG ---
+class TariffCatalog:
+    # Весь справочник тарифов в памяти процесса с индексами по id, title и (category, channel_name)
+
+    def __init__(self, repository, ttl: float = TARIFF_CACHE_TTL):
+        self.repository = repository
+        self.ttl = ttl
+
+        self.by_id = {}
+        self.by_title = {}
+        self.by_group = {}  # (category, channel_name) -> активные тарифы
+
+        self.loaded_at = None
+        self.version = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    async def refresh(self):
+        tariffs = await self.repository.list_all()
+
+        by_id, by_title, by_group = {}, {}, {}
+        for tariff in tariffs:
+            by_id[str(tariff["id"])] = tariff
+            by_title.setdefault(tariff["title"], tariff)
+            if tariff.get("is_active"):
+                key = (tariff.get("category"), tariff.get("channel_name"))
+                by_group.setdefault(key, []).append(tariff)
+
+        self.by_id, self.by_title, self.by_group = by_id, by_title, by_group
+        self.loaded_at = time.monotonic()
+        self.version += 1
+
+    async def ensure_fresh(self):
+        if not self.is_stale:
+            return
+        async with self._lock:
+            if not self.is_stale:
+                return
+            try:
+                await self.refresh()
+            except Exception as e:
+                if self.loaded_at is None and not self.by_id:
+                    raise
+                # Отдаём старые данные, пока база недоступна
+                logger.error("❌ Tariff catalog refresh failed, serving stale data: %s", e)
+                self.loaded_at = time.monotonic()
+
+    async def get(self, tariff_id) -> Optional[dict]:
+        await self.ensure_fresh()
+        return self.by_id.get(str(tariff_id))
+
+    async def get_many(self, tariff_ids) -> dict:
+        await self.ensure_fresh()
+        return {
+            str(tariff_id): self.by_id[str(tariff_id)]
+            for tariff_id in tariff_ids
+            if str(tariff_id) in self.by_id
+        }
+
+    async def get_by_title(self, title: str) -> Optional[dict]:
+        await self.ensure_fresh()
+        return self.by_title.get(title)
+
+    async def list_active(self, category, channel_name) -> list:
+        await self.ensure_fresh()
+        return self.by_group.get((category, channel_name), [])
+
+
+# --- USER CACHE ---
+class UserCache:
+    # LRU по Telegram user id с TTL на каждую запись
+
+    def __init__(self, repository, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.repository = repository
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # user_id -> (expires_at, user)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def put(self, user: dict):
+        user_id = int(user["id"])
+        self._entries[user_id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id):
+        self._entries.pop(int(user_id), None)
+
+    def peek(self, user_id) -> Optional[dict]:
+        entry = self._entries.get(int(user_id))
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[int(user_id)]
+            return None
+        self._entries.move_to_end(int(user_id))
+        return user
+
+    async def get(self, user_id) -> Optional[dict]:
+        user = self.peek(user_id)
+        if user is not None:
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        user = await self.repository.get(user_id)
+        if user:
+            self.put(user)
+        return user
+
+    async def create(self, user: dict) -> dict:
+        # write-through: сразу пишем в базу и в кэш
+        user = await self.repository.create(user)
+        self.put(user)
+        return user
+
+
+# --- IDEMPOTENCY ---
+class IdempotencyCache:
+    # Ключи уже принятых событий от платёжек; ограничен по размеру и по времени жизни
+
+    def __init__(self, max_size: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._keys = OrderedDict()  # key -> expires_at
+
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def seen(self, key: str) -> bool:
+        expires_at = self._keys.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._keys[key]
+            return False
+        return True
+
+    def claim(self, key: str) -> bool:
+        # True — событие новое и теперь закреплено за нами, False — повтор
+        if self.seen(key):
+            self.duplicates += 1
+            return False
+        self._keys[key] = time.monotonic() + self.ttl
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return True
+
+    def release(self, key: str):
+        self._keys.pop(key, None)
+
+
+# --- OPEN INVOICES ---
+class OpenInvoiceCache:
+    # Неоплаченные счета CryptoCloud по (user_id, tariff_id): повторное нажатие «Pay by crypto»
+    # получает уже созданную ссылку вместо нового invoice/create
+
+    def __init__(self, repository, ttl: float = INVOICE_REUSE_TTL, max_size: int = INVOICE_CACHE_SIZE):
+        self.repository = repository
+        self.ttl = ttl
+        self.max_size = max_size
+        self._invoices = OrderedDict()  # (user_id, tariff_id) -> (invoice, expires_at)
+        self._locks = {}  # (user_id, tariff_id) -> [asyncio.Lock, refs]
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id, tariff_id) -> tuple:
+        return str(user_id), str(tariff_id)
+
+    def put(self, invoice: dict):
+        key = self._key(invoice["user_id"], invoice["tariff_id"])
+        self._invoices[key] = (invoice, time.time() + self.ttl)
+        self._invoices.move_to_end(key)
+        while len(self._invoices) > self.max_size:
+            self._invoices.popitem(last=False)
+
+    def discard(self, user_id, tariff_id):
+        self._invoices.pop(self._key(user_id, tariff_id), None)
+
+    async def get(self, user_id, tariff_id) -> Optional[dict]:
+        key = self._key(user_id, tariff_id)
+        entry = self._invoices.get(key)
+        if entry is not None:
+            invoice, expires_at = entry
+            if expires_at > time.time():
+                self.hits += 1
+                return invoice
+            del self._invoices[key]
+
+        # Счёт мог создать другой процесс или реплика
+        self.misses += 1
+        created_after = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        invoice = await self.repository.find_open(user_id, tariff_id, created_after.isoformat())
+        if invoice is not None:
+            self.put(invoice)
+        return invoice
+
+    @asynccontextmanager
+    async def lock(self, user_id, tariff_id):
+        # Двойное нажатие: второй запрос ждёт первый и получает его счёт
+        key = self._key(user_id, tariff_id)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]  # lock, сколько запросов его держат или ждут
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+# --- ACTIVE SUBSCRIPTIONS ---
+class ActiveSubscriptionIndex:
+    # Активные подписки в памяти: user_id -> {subscription_id: {tariff_id, ends_at, ...}}.
+    # Обновляется при оплатах и истечении, раз в reconcile_interval перечитывается из базы.
+    # Пока первая загрузка не закончилась, запросы идут в базу как раньше.
+    # sync_interval — для нескольких процессов: раз в столько секунд подтягиваем подписки,
+    # оформленные соседями; истёкшие у соседей отсекаются по ends_at.
+
+    def __init__(
+        self,
+        repository,
+        reconcile_interval: float = SUBSCRIPTION_INDEX_RECONCILE_INTERVAL,
+        page_size: int = SUBSCRIPTION_INDEX_PAGE_SIZE,
+        sync_interval: Optional[float] = None,
+        sync_overlap: float = SUBSCRIPTION_INDEX_SYNC_OVERLAP,
+    ):
+        self.repository = repository
+        self.reconcile_interval = reconcile_interval
+        self.page_size = page_size
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self._synced_at = 0.0
+
+        self._by_user = {}
+        self._pending = None  # изменения, пришедшие во время перезагрузки
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+        self.loaded = False
+        self.loaded_at = 0.0
+
+    def __len__(self):
+        return sum(len(subs) for subs in self._by_user.values())
+
+    def _apply(self, index: dict, op: str, sub: dict):
+        user_id = str(sub["user_id"])
+        if op == "add":
+            index.setdefault(user_id, {})[str(sub["id"])] = {
+                "id": sub["id"],
+                "user_id": sub["user_id"],
+                "tariff_id": sub["tariff_id"],
+                "ends_at": sub["ends_at"],
+            }
+        else:
+            subs = index.get(user_id)
+            if subs is not None:
+                subs.pop(str(sub["id"]), None)
+                if not subs:
+                    del index[user_id]
+
+    def add(self, subscription: dict):
+        self._apply(self._by_user, "add", subscription)
+        if self._pending is not None:
+            self._pending.append(("add", subscription))
+
+    def remove(self, subscriptions: list):
+        for sub in subscriptions:
+            self._apply(self._by_user, "remove", sub)
+            if self._pending is not None:
+                self._pending.append(("remove", sub))
+
+    @staticmethod
+    def _current(sub: dict, now: float) -> bool:
+        # Подписку мог уже погасить sweeper другого процесса — до reconcile она ещё в индексе
+        return not sub["ends_at"] or parse_timestamp(sub["ends_at"]) > now
+
+    async def has_active(self, user_id, tariff_id) -> bool:
+        if not self.loaded:
+            return await self.repository.has_active(user_id, tariff_id)
+        subs = self._by_user.get(str(user_id), {})
+        now = time.time()
+        return any(str(sub["tariff_id"]) == str(tariff_id) and self._current(sub, now) for sub in subs.values())
+
+    async def list_active(self, user_id) -> list:
+        if not self.loaded:
+            return await self.repository.list_active(user_id)
+        now = time.time()
+        return [sub for sub in self._by_user.get(str(user_id), {}).values() if self._current(sub, now)]
+
+    async def sync(self):
+        started = time.time()
+        since = datetime.fromtimestamp(self._synced_at - self.sync_overlap, timezone.utc).isoformat()
+        cursor = None
+        while True:
+            rows = await self.repository.list_active_started_since(since, after=cursor, limit=self.page_size)
+            for row in rows:
+                self.add(row)
+            if len(rows) < self.page_size:
+                break
+            cursor = rows[-1]["started_at"], rows[-1]["id"]
+        self._synced_at = started
+
+    async def reload(self):
+        # Новый индекс строится рядом; записи, сделанные за время загрузки, доигрываем поверх
+        started = time.time()
+        self._pending = []
+        try:
+            index = {}
+            cursor = None
+            while True:
+                rows = await self.repository.list_active_page(after=cursor, limit=self.page_size)
+                for row in rows:
+                    self._apply(index, "add", row)
+                if len(rows) < self.page_size:
+                    break
+                cursor = rows[-1]["id"]
+            for op, sub in self._pending:
+                self._apply(index, op, sub)
+        finally:
+            self._pending = None
+        self._by_user = index
+        self.loaded = True
+        self.loaded_at = time.time()
+        self._synced_at = started
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        next_reload = 0.0
+        while not self._stopping:
+            if time.monotonic() >= next_reload:
+                try:
+                    await self.reload()
+                    next_reload = time.monotonic() + self.reconcile_interval
+                except Exception as e:
+                    logger.error("❌ Subscription index reload failed: %s", e)
+                    next_reload = time.monotonic() + (5 if not self.loaded else self.reconcile_interval)
+            elif self.sync_interval:
+                try:
+                    await self.sync()
+                except Exception as e:
+                    logger.error("❌ Subscription index sync failed: %s", e)
+
+            delay = max(0.0, next_reload - time.monotonic())
+            if self.sync_interval and self.loaded:
+                delay = min(delay, self.sync_interval)
+            if self._stopping:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,324 @@
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from httpx import AsyncClient, Limits, Timeout
+from postgrest import AsyncPostgrestClient
+from postgrest.types import ReturnMethod
+
+from metrics import track_supabase
+
+
+# --- SETTINGS ---
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", 20))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", 20))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", 10))
+
+
+# --- POSTGREST CLIENT ---
+class PooledPostgrestClient(AsyncPostgrestClient):
+    # Один httpx.AsyncClient с keep-alive пулом на весь процесс
+
+    def __init__(self, base_url: str, *, headers: dict, timeout: float, max_connections: int):
+        self._limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        super().__init__(base_url, headers=headers, timeout=Timeout(timeout))
+
+    def create_session(self, base_url, headers, timeout) -> AsyncClient:
+        return AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=self._limits,
+        )
+
+
+class Database:
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        max_concurrency: int = SUPABASE_MAX_CONCURRENCY,
+        max_connections: int = SUPABASE_MAX_CONNECTIONS,
+        timeout: float = SUPABASE_TIMEOUT,
+    ):
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+        # Ограничиваем число одновременных запросов к PostgREST
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.users = UsersRepository(self)
+        self.tariffs = TariffsRepository(self)
+        self.subscriptions = SubscriptionsRepository(self)
+        self.invoices = InvoicesRepository(self)
+        self.http_logs = HttpLogsRepository(self)
+        self.processed_events = ProcessedEventsRepository(self)
+
+    @property
+    def client(self) -> PooledPostgrestClient:
+        # HTTP-клиент создаём при первом запросе, а не при импорте модуля
+        if self._client is None:
+            self._client = PooledPostgrestClient(
+                f"{self.url}/rest/v1",
+                headers={"apiKey": self.key, "Authorization": f"Bearer {self.key}"},
+                timeout=self.timeout,
+                max_connections=self.max_connections,
+            )
+        return self._client
+
+    def table(self, name: str):
+        return self.client.from_(name)
+
+    async def execute(self, query):
+        async with self._semaphore:
+            with track_supabase(query):
+                return await query.execute()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# --- REPOSITORIES ---
+class Repository:
+    table_name = ""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def query(self):
+        return self.db.table(self.table_name)
+
+    async def fetch(self, query) -> list:
+        return (await self.db.execute(query)).data or []
+
+    async def fetch_one(self, query) -> Optional[dict]:
+        rows = await self.fetch(query.limit(1))
+        return rows[0] if rows else None
+
+
+class UsersRepository(Repository):
+    table_name = "users"
+
+    async def get(self, user_id) -> Optional[dict]:
+        return await self.fetch_one(self.query().select("*").eq("id", user_id))
+
+    async def create(self, user: dict) -> dict:
+        rows = await self.fetch(self.query().insert(user))
+        return rows[0] if rows else user
+
+    async def get_many(self, user_ids) -> dict:
+        user_ids = [str(user_id) for user_id in set(user_ids)]
+        if not user_ids:
+            return {}
+        rows = await self.fetch(self.query().select("*").in_("id", user_ids))
+        return {str(row["id"]): row for row in rows}
+
+    async def list_page(self, category=None, channel=None, after=None, limit: int = 1000) -> list:
+        # Keyset-пагинация по id для рассылок
+        query = self.query().select("id, lang, category, channel")
+        if category is not None:
+            query = query.eq("category", category)
+        if channel is not None:
+            query = query.eq("channel", channel)
+        if after is not None:
+            query = query.gt("id", after)
+        return await self.fetch(query.order("id").limit(limit))
+
+
+class TariffsRepository(Repository):
+    table_name = "tariffs"
+
+    async def get(self, tariff_id) -> Optional[dict]:
+        return await self.fetch_one(self.query().select("*").eq("id", tariff_id))
+
+    async def list_all(self) -> list:
+        return await self.fetch(self.query().select("*"))
+
+    async def get_by_title(self, title: str) -> Optional[dict]:
+        return await self.fetch_one(self.query().select("*").eq("title", title))
+
+    async def list_active(self, category, channel_name) -> list:
+        return await self.fetch(
+            self.query()
+            .select("*")
+            .eq("is_active", True)
+            .eq("category", category)
+            .eq("channel_name", channel_name)
+        )
+
+
+class SubscriptionsRepository(Repository):
+    table_name = "subscriptions"
+
+    async def list_active(self, user_id) -> list:
+        return await self.fetch(
+            self.query()
+            .select("*")
+            .eq("user_id", user_id)
+            .eq("status", "active")
+        )
+
+    async def has_active(self, user_id, tariff_id) -> bool:
+        row = await self.fetch_one(
+            self.query()
+            .select("id")
+            .eq("user_id", user_id)
+            .eq("tariff_id", tariff_id)
+            .eq("status", "active")
+        )
+        return row is not None
+
+    async def create(self, subscription: dict) -> dict:
+        rows = await self.fetch(self.query().insert(subscription))
+        return rows[0] if rows else subscription
+
+    async def upsert(self, subscription: dict) -> dict:
+        rows = await self.fetch(self.query().upsert(subscription))
+        return rows[0] if rows else subscription
+
+    async def create_once(self, subscription: dict) -> bool:
+        # INSERT ... ON CONFLICT DO NOTHING: False, если строка с таким id уже есть
+        rows = await self.fetch(self.query().upsert(subscription, ignore_duplicates=True))
+        return bool(rows)
+
+    async def get(self, subscription_id) -> Optional[dict]:
+        return await self.fetch_one(self.query().select("*").eq("id", subscription_id))
+
+    async def list_active_page(self, after=None, limit: int = 1000) -> list:
+        # Все активные подписки, keyset-пагинация по id
+        query = self.query().select("id, user_id, tariff_id, ends_at").eq("status", "active")
+        if after is not None:
+            query = query.gt("id", after)
+        return await self.fetch(query.order("id").limit(limit))
+
+    async def list_active_started_since(self, since: str, after=None, limit: int = 1000) -> list:
+        # Новые и продлённые подписки: started_at проставляется при каждой оплате.
+        # Keyset-пагинация по (started_at, id): страница из одинаковых started_at не зацикливает обход
+        query = (
+            self.query()
+            .select("id, user_id, tariff_id, ends_at, started_at")
+            .eq("status", "active")
+            .gte("started_at", since)
+        )
+        if after is not None:
+            started_at, subscription_id = after
+            query.params = query.params.add(
+                "or", f'(started_at.gt."{started_at}",and(started_at.eq."{started_at}",id.gt."{subscription_id}"))'
+            )
+        return await self.fetch(query.order("started_at,id").limit(limit))
+
+    async def list_active_ending_before(self, until: str, after=None, limit: int = 1000, since: str = None) -> list:
+        # Keyset-пагинация по (ends_at, id)
+        query = (
+            self.query()
+            .select("id, user_id, tariff_id, ends_at")
+            .eq("status", "active")
+            .lte("ends_at", until)
+        )
+        if since is not None:
+            query = query.gt("ends_at", since)
+        if after is not None:
+            # В postgrest 0.10 нет .or_(), добавляем параметр напрямую
+            ends_at, subscription_id = after
+            query.params = query.params.add(
+                "or", f'(ends_at.gt."{ends_at}",and(ends_at.eq."{ends_at}",id.gt."{subscription_id}"))'
+            )
+        return await self.fetch(query.order("ends_at,id").limit(limit))
+
+    async def expire(self, subscription_ids: list) -> list:
+        # status=active и ends_at в фильтре: уже истёкшие строки и продлённые другим процессом не трогаем
+        return await self.fetch(
+            self.query()
+            .update({"status": "expired"})
+            .in_("id", subscription_ids)
+            .eq("status", "active")
+            .lte("ends_at", datetime.now(timezone.utc).isoformat())
+        )
+
+
+class InvoicesRepository(Repository):
+    table_name = "invoices"
+
+    async def create(self, invoice: dict) -> dict:
+        rows = await self.fetch(self.query().insert(invoice))
+        return rows[0] if rows else invoice
+
+    async def find_open(self, user_id, tariff_id, created_after: str) -> Optional[dict]:
+        # Последний неоплаченный счёт пользователя по тарифу; в Supabase нужен индекс
+        # invoices (user_id, tariff_id, status, created_at)
+        return await self.fetch_one(
+            self.query()
+            .select("*")
+            .eq("user_id", user_id)
+            .eq("tariff_id", tariff_id)
+            .eq("status", "created")
+            .gt("created_at", created_after)
+            .order("created_at", desc=True)
+        )
+
+    async def mark_paid(self, order_id: str, paid_at: str) -> Optional[dict]:
+        rows = await self.fetch(
+            self.query()
+            .update({"status": "paid", "paid_at": paid_at})
+            .eq("order_id", order_id)
+        )
+        return rows[0] if rows else None
+
+
+class ProcessedEventsRepository(Repository):
+    # Выполнение платёжных событий ровно один раз на все процессы и реплики. В Supabase:
+    # processed_events (id text primary key, status text, claimed_at timestamptz, done_at timestamptz)
+    table_name = "processed_events"
+
+    async def claim(self, event_id: str, lease: float) -> str:
+        # "claimed" — событие наше, "done" — уже выполнено, "busy" — сейчас выполняет другой процесс
+        now = datetime.now(timezone.utc)
+        rows = await self.fetch(
+            self.query().upsert(
+                {"id": event_id, "status": "claimed", "claimed_at": now.isoformat()},
+                ignore_duplicates=True,
+            )
+        )
+        if rows:
+            return "claimed"
+        # Заявку процесса, упавшего посреди выполнения, забираем после истечения аренды
+        rows = await self.fetch(
+            self.query()
+            .update({"claimed_at": now.isoformat()})
+            .eq("id", event_id)
+            .eq("status", "claimed")
+            .lt("claimed_at", (now - timedelta(seconds=lease)).isoformat())
+        )
+        if rows:
+            return "claimed"
+        row = await self.fetch_one(self.query().select("status").eq("id", event_id))
+        return "done" if row and row["status"] == "done" else "busy"
+
+    async def complete(self, event_id: str):
+        await self.db.execute(
+            self.query()
+            .update({"status": "done", "done_at": datetime.now(timezone.utc).isoformat()}, returning=ReturnMethod.minimal)
+            .eq("id", event_id)
+        )
+
+    async def release(self, event_id: str):
+        # Выполнение упало до отправки сообщений — повтор сможет сразу забрать событие
+        await self.db.execute(
+            self.query().delete(returning=ReturnMethod.minimal).eq("id", event_id).eq("status", "claimed")
+        )
+
+
+class HttpLogsRepository(Repository):
+    table_name = "http_logs"
+
+    async def insert(self, rows):
+        # Логи нам не нужно читать обратно
+        await self.db.execute(self.query().insert(rows, returning=ReturnMethod.minimal))
@@ -0,0 +1,185 @@
+import os
+import asyncio
+import logging
+from collections import deque
+
+from aiohttp import web
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 32))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 2000))
+UPDATE_QUEUE_PUT_TIMEOUT = float(os.getenv("UPDATE_QUEUE_PUT_TIMEOUT", 5))  # сколько держим запрос при полной очереди
+UPDATE_LANE_SIZE = int(os.getenv("UPDATE_LANE_SIZE", 20))  # больше апдейтов одного пользователя в очереди не держим
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", 20))
+
+
+def update_key(update: dict):
+    # Порядок держим по пользователю, а если его нет (посты в каналах) — по чату
+    for field, value in update.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+    return ("update", update.get("update_id"))
+
+
+class UpdateQueue:
+    # Ограниченная очередь апдейтов Telegram и пул воркеров.
+    # У каждого пользователя своя FIFO-полоса: его апдейты выполняются строго по одному,
+    # разные пользователи — параллельно. В _ready лежат полосы, которые никто не обрабатывает.
+
+    def __init__(
+        self,
+        process,
+        workers: int = UPDATE_WORKERS,
+        max_size: int = UPDATE_QUEUE_SIZE,
+        put_timeout: float = UPDATE_QUEUE_PUT_TIMEOUT,
+        lane_size: int = UPDATE_LANE_SIZE,
+        drain_timeout: float = UPDATE_DRAIN_TIMEOUT,
+    ):
+        self.process = process  # корутина (update: dict)
+        self.workers = workers
+        self.max_size = max_size
+        self.put_timeout = put_timeout
+        self.lane_size = lane_size
+        self.drain_timeout = drain_timeout
+
+        self._lanes = {}       # key -> deque[update]
+        self._ready = deque()  # ключи полос, готовых к обработке
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._tasks = []
+        self._stopping = False
+
+        self.accepted = 0
+        self.rejected = 0  # очередь полна — Telegram повторит доставку
+        self.shed = 0      # у пользователя уже lane_size апдейтов — лишние клики выбрасываем
+        self.processed = 0
+        self.failed = 0
+
+    def __len__(self):
+        return self._size
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "users": len(self._lanes),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def put(self, update: dict) -> bool:
+        # False — не приняли (переполнение или остановка), ответить Telegram ошибкой
+        key = update_key(update)
+        lane = self._lanes.get(key)
+        if lane is not None and len(lane) >= self.lane_size:
+            self.shed += 1
+            return True
+
+        if self._size >= self.max_size and not self._stopping:
+            # Держим запрос: пока Telegram ждёт ответа, он не шлёт новые апдейты по этому соединению
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.put_timeout
+            while self._size >= self.max_size and not self._stopping:
+                self._space.clear()
+                try:
+                    await asyncio.wait_for(self._space.wait(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+        if self._stopping or self._size >= self.max_size:
+            self.rejected += 1
+            return False
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+            self._ready.append(key)
+        lane.append(update)
+        self._size += 1
+        self.accepted += 1
+        self._wakeup.set()
+        return True
+
+    def start(self):
+        if not self._tasks:
+            self._stopping = False
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Новые апдейты больше не принимаем, уже принятые дорабатываем (не дольше drain_timeout)
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._space.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=self.drain_timeout)
+        if pending:
+            logger.warning("⚠️ %s updates were not processed before shutdown", self._size)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while self._ready or not self._stopping:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            key = self._ready.popleft()
+            lane = self._lanes[key]
+            update = lane.popleft()
+            self._size -= 1
+            self._space.set()
+            try:
+                await self.process(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                ERRORS.inc(component="updates")
+                logger.error("❌ Failed to process update %s: %s", update.get("update_id"), e, exc_info=True)
+
+            # Пока полоса была у нас, новые апдейты пользователя копились в ней; в _ready — в конец, по очереди
+            if lane:
+                self._ready.append(key)
+                self._wakeup.set()
+            else:
+                del self._lanes[key]
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    # /webhook: апдейт сразу отдаём в UpdateQueue и отвечаем Telegram, не дожидаясь хендлеров
+
+    def __init__(self, dispatcher, bot, secret_token=None, **data):
+        # handle_in_background=False: иначе handle() уводит апдейт в _handle_request_background
+        # и до нашего _handle_request (а значит и до очереди) он не доходит
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=False, secret_token=secret_token, **data)
+        self.queue = UpdateQueue(self.process)
+
+    async def process(self, update: dict):
+        result = await self.dispatcher.feed_raw_update(bot=self.bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+    async def _handle_request(self, bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        if not await self.queue.put(update):
+            # Не 200: Telegram повторит доставку позже
+            return web.json_response({"ok": False, "error": "Overloaded"}, status=503)
+        return web.json_response({})
@@ -0,0 +1,210 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from outbound import send_priority, PRIORITY_ADMIN
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+INVITE_POOL_SIZE = int(os.getenv("INVITE_POOL_SIZE", 5))  # ссылок про запас на каждый канал
+# Ссылки создаются без expire_date, как и раньше: выданная пользователю не должна истечь.
+# Невыданные старше этого возраста отзываем и заменяем свежими
+INVITE_LINK_MAX_AGE = float(os.getenv("INVITE_LINK_MAX_AGE", 7 * 24 * 3600))
+INVITE_POOL_REFRESH_INTERVAL = float(os.getenv("INVITE_POOL_REFRESH_INTERVAL", 60))
+INVITE_POOL_CREATE_INTERVAL = float(os.getenv("INVITE_POOL_CREATE_INTERVAL", 0.2))  # пауза между createChatInviteLink
+INVITE_POOL_RETRY_DELAY = float(os.getenv("INVITE_POOL_RETRY_DELAY", 5))  # канал с ошибкой — пауза, удваивается
+INVITE_POOL_RETRY_MAX_DELAY = float(os.getenv("INVITE_POOL_RETRY_MAX_DELAY", 600))
+
+
+class InviteLinkPool:
+    # Заранее созданные одноразовые инвайт-ссылки по channel_id.
+    # Выдача — popleft из deque, пополнение — фоновая задача.
+
+    def __init__(
+        self,
+        bot,
+        channels=None,
+        size: int = INVITE_POOL_SIZE,
+        max_age: float = INVITE_LINK_MAX_AGE,
+        refresh_interval: float = INVITE_POOL_REFRESH_INTERVAL,
+        create_interval: float = INVITE_POOL_CREATE_INTERVAL,
+        retry_delay: float = INVITE_POOL_RETRY_DELAY,
+        retry_max_delay: float = INVITE_POOL_RETRY_MAX_DELAY,
+    ):
+        self.bot = bot
+        self.channels = channels  # корутина -> множество channel_id, для которых держим запас
+        self.size = size
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.create_interval = create_interval
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+
+        self._pools = {}  # channel_id -> deque[(invite_link, created_at)]
+        self._stale = []  # (channel_id, invite_link) — отозвать в фоне
+        self._backoff = {}  # channel_id -> (retry_at, delay): канал, где createChatInviteLink падает
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.retired = 0
+        self.errors = 0
+
+    def __len__(self):
+        return sum(len(pool) for pool in self._pools.values())
+
+    def stats(self) -> dict:
+        return {
+            "channels": {str(channel_id): len(pool) for channel_id, pool in self._pools.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "created": self.created,
+            "retired": self.retired,
+            "errors": self.errors,
+            "backoff": [str(channel_id) for channel_id in self._backoff],
+        }
+
+    def watch(self, channel_id):
+        if channel_id not in self._pools:
+            self._pools[channel_id] = deque()
+            self._wakeup.set()
+
+    async def take(self, channel_id) -> str:
+        self.watch(channel_id)
+        pool = self._pools[channel_id]
+        now = time.time()
+        while pool:
+            invite_link, created_at = pool.popleft()
+            if now - created_at < self.max_age:
+                self.hits += 1
+                self._wakeup.set()
+                return invite_link
+            self._retire(channel_id, invite_link)
+
+        # Запас кончился — создаём ссылку прямо сейчас, как раньше
+        self.misses += 1
+        self._wakeup.set()
+        invite_link, _ = await self._create(channel_id)
+        return invite_link
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def _create(self, channel_id):
+        created_at = time.time()
+        invite = await self.bot.create_chat_invite_link(chat_id=channel_id, member_limit=1)
+        self.created += 1
+        return invite.invite_link, created_at
+
+    def _retire(self, channel_id, invite_link):
+        self._stale.append((channel_id, invite_link))
+        self.retired += 1
+
+    def _retire_stale(self):
+        # Срока у ссылок нет, поэтому старые невыданные не бросаем, а отзываем (_revoke_stale)
+        cutoff = time.time() - self.max_age
+        for channel_id, pool in self._pools.items():
+            while pool and pool[0][1] < cutoff:
+                self._retire(channel_id, pool.popleft()[0])
+
+    async def _revoke_stale(self):
+        while self._stale and not self._stopping:
+            channel_id, invite_link = self._stale[-1]
+            try:
+                await self.bot.revoke_chat_invite_link(chat_id=channel_id, invite_link=invite_link)
+            except TelegramRetryAfter:
+                raise
+            except Exception as e:
+                # Канал удалён или бот больше не админ — отзывать нечего
+                logger.warning("⚠️ Failed to revoke invite link in %s: %s", channel_id, e)
+            self._stale.pop()
+            await asyncio.sleep(self.create_interval)
+
+    async def _refresh_channels(self):
+        if self.channels is None:
+            return
+        channel_ids = set(await self.channels())
+        for channel_id in channel_ids:
+            self.watch(channel_id)
+        # Каналы, пропавшие из тарифов, больше не пополняем
+        for channel_id in list(self._pools):
+            if channel_id not in channel_ids and not self._pools[channel_id]:
+                del self._pools[channel_id]
+                self._backoff.pop(channel_id, None)
+
+    async def _fill(self):
+        # Ошибка одного канала (бот не админ, канал удалён) не должна мешать пополнять остальные:
+        # такой канал откладываем с растущей паузой. TelegramRetryAfter общий для бота — пробрасываем
+        for channel_id, pool in list(self._pools.items()):
+            retry_at, delay = self._backoff.get(channel_id, (0.0, 0.0))
+            if time.monotonic() < retry_at:
+                continue
+            try:
+                while len(pool) < self.size and not self._stopping:
+                    pool.append(await self._create(channel_id))
+                    await asyncio.sleep(self.create_interval)
+            except TelegramRetryAfter:
+                raise
+            except Exception as e:
+                self.errors += 1
+                delay = min(delay * 2, self.retry_max_delay) if delay else self.retry_delay
+                self._backoff[channel_id] = (time.monotonic() + delay, delay)
+                logger.error("❌ Invite pool: channel %s failed, retry in %.0fs: %s", channel_id, delay, e)
+                continue
+            self._backoff.pop(channel_id, None)
+
+    def _next_wakeup(self, next_refresh: float) -> float:
+        # Проснуться к обновлению списка каналов или к повтору отложенного канала
+        return min([next_refresh, *(retry_at for retry_at, _ in self._backoff.values())])
+
+    async def _run(self):
+        # Пополнение пула уступает ответам пользователям в очереди исходящих запросов
+        with send_priority(PRIORITY_ADMIN):
+            await self._maintain()
+
+    async def _maintain(self):
+        next_refresh = 0.0
+        while not self._stopping:
+            try:
+                if time.monotonic() >= next_refresh:
+                    await self._refresh_channels()
+                    next_refresh = time.monotonic() + self.refresh_interval
+                self._retire_stale()
+                await self._fill()
+                await self._revoke_stale()
+            except TelegramRetryAfter as e:
+                logger.warning("⚠️ Invite pool rate limited, retry in %ss", e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                logger.error("❌ Invite pool error: %s", e)
+                await asyncio.sleep(5)
+                continue
+
+            # stop() мог прийти, пока пополняли пул: clear() съел бы его сигнал
+            if self._stopping:
+                break
+            self._wakeup.clear()
+            try:
+                timeout = max(0.0, self._next_wakeup(next_refresh) - time.monotonic())
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 8))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT,
+    owner INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, run_at);
+"""
+
+
+def _prepare(conn):
+    conn.executescript(SCHEMA)
+    # Файлы, созданные до появления owner
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "owner" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+
+
+def _reset_running(conn, owner: int = None) -> int:
+    # Задачи, которые выполнялись в момент падения процесса, запускаем заново.
+    # owner — pid упавшего воркера: трогаем только его задачи, остальные ещё выполняются
+    if owner is None:
+        return conn.execute("UPDATE jobs SET status = 'pending', owner = NULL WHERE status = 'running'").rowcount
+    return conn.execute(
+        "UPDATE jobs SET status = 'pending', owner = NULL WHERE status = 'running' AND owner = ?",
+        (owner,),
+    ).rowcount
+
+
+class JobQueue:
+    # Долговечная локальная очередь задач (SQLite) + пул воркеров с повторами.
+    # Все обращения к SQLite идут через один поток, чтобы не блокировать event loop.
+
+    def __init__(
+        self,
+        path: str = JOB_QUEUE_PATH,
+        workers: int = JOB_WORKERS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_delay: float = JOB_RETRY_DELAY,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        recover: bool = True,
+    ):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        # С несколькими процессами на одном файле 'running' может быть чужой задачей —
+        # тогда восстановление делает родитель: всё до fork и задачи упавшего воркера (recover_interrupted)
+        self.recover = recover
+
+        self.handlers = {}
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-sqlite")
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._stopping = False
+
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # --- SQLITE (выполняется в потоке executor'а) ---
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _prepare(conn)
+        if self.recover:
+            _reset_running(conn)
+        self._conn = conn
+
+    def recover_interrupted(self, owner: int = None) -> int:
+        # Синхронно и без executor'а: вызывается в родительском процессе до fork воркеров
+        # и после смерти воркера (owner=pid), до его перезапуска
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        try:
+            _prepare(conn)
+            return _reset_running(conn, owner)
+        finally:
+            conn.close()
+
+    def _insert(self, kind: str, payload: str, run_at: float) -> int:
+        cur = self._conn.execute(
+            "INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+            (kind, payload, run_at, time.time()),
+        )
+        return cur.lastrowid
+
+    def _claim(self, now: float):
+        # BEGIN IMMEDIATE: файл могут разбирать несколько процессов, SELECT и UPDATE — под одной блокировкой
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT id, kind, payload, attempts FROM jobs "
+                "WHERE status = 'pending' AND run_at <= ? ORDER BY run_at, id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ? WHERE id = ?",
+                    (os.getpid(), row[0]),
+                )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], row[2], row[3] + 1
+
+    def _complete(self, job_id: int):
+        self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _retry(self, job_id: int, run_at: float, error: str):
+        self._conn.execute(
+            "UPDATE jobs SET status = 'pending', run_at = ?, last_error = ? WHERE id = ?",
+            (run_at, error, job_id),
+        )
+
+    def _fail(self, job_id: int, error: str):
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', last_error = ? WHERE id = ?",
+            (error, job_id),
+        )
+
+    def _stats(self, now: float) -> dict:
+        counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = self._conn.execute(
+            "SELECT MIN(created_at) FROM jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "failed": counts.get("failed", 0),
+            "lag_seconds": round(now - oldest, 3) if oldest else 0.0,
+        }
+
+    # --- API ---
+    async def enqueue(self, kind: str, payload: dict, delay: float = 0) -> int:
+        job_id = await self._call(self._insert, kind, json.dumps(payload), time.time() + delay)
+        self._wakeup.set()
+        return job_id
+
+    async def stats(self) -> dict:
+        stats = await self._call(self._stats, time.time())
+        stats.update(completed=self.completed, retried=self.retried, failed_total=self.failed)
+        return stats
+
+    async def start(self):
+        if self._conn is None:
+            await self._call(self._open)
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        # Воркеры доделывают текущую задачу и выходят, остальное останется в SQLite.
+        # enqueue() продолжает работать до close()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def close(self):
+        await self.stop()
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+
+    async def _worker(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            job = await self._call(self._claim, time.time())
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Соседние воркеры тоже могут забрать задачу
+            self._wakeup.set()
+            await self._run_job(*job)
+
+    async def _run_job(self, job_id: int, kind: str, payload: str, attempts: int):
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job kind {kind!r}")
+            await handler(json.loads(payload))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            ERRORS.inc(component="jobs")
+            if attempts >= self.max_attempts:
+                self.failed += 1
+                logger.error("❌ Job %s (%s) failed after %s attempts: %s", job_id, kind, attempts, error)
+                await self._call(self._fail, job_id, error)
+            else:
+                self.retried += 1
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                logger.warning("⚠️ Job %s (%s) attempt %s failed, retry in %.1fs: %s", job_id, kind, attempts, delay, error)
+                await self._call(self._retry, job_id, time.time() + delay, error)
+            return
+        self.completed += 1
+        await self._call(self._complete, job_id)
@@ -0,0 +1,66 @@
+from functools import lru_cache
+from typing import Optional
+
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+# --- MENU ---
+@lru_cache(maxsize=None)
+def get_main_keyboard(lang: str, category: Optional[str]) -> ReplyKeyboardMarkup:
+    buttons = []
+    if category == "of":
+        label_sub = "Моя подписка" if lang == "ru" else "My subscription"
+        label_plans = "📋 Тарифы" if lang == "ru" else "📋 Plans"
+        buttons = [[KeyboardButton(text=label_sub)], [KeyboardButton(text=label_plans)]]
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+
+
+# --- PLAN DETAIL ---
+@lru_cache(maxsize=1024)
+def get_plan_detail_keyboard(tariff_id: str) -> InlineKeyboardMarkup:
+    buttons = [
+        [
+            InlineKeyboardButton(text="💳 Pay by card", callback_data=f"pay_card_{tariff_id}"),
+            InlineKeyboardButton(text="🪙 Pay by crypto", callback_data=f"pay_crypto_{tariff_id}")
+        ],
+        [
+            InlineKeyboardButton(text="🔙 Back", callback_data="back_to_plans")
+        ]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+# --- PLAN LIST ---
+def build_plan_list_keyboard(tariffs: list) -> InlineKeyboardMarkup:
+    buttons = []
+    for tariff in tariffs:
+        duration_days = int(tariff["lifetime"]) // 1440  # 60*24 = 1440 минут в дне
+        text = f"{tariff['title']} | {tariff['price']}$ | {duration_days} days"
+        callback_data = f"plan_{tariff['id']}"
+        buttons.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+class PlanListKeyboards:
+    # Готовые клавиатуры тарифов по (category, channel_name, lang); сбрасываются при смене версии каталога
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._markups = {}
+        self._version = None
+
+    def invalidate(self):
+        self._markups.clear()
+        self._version = None
+
+    async def get(self, category, channel_name, lang: str) -> Optional[InlineKeyboardMarkup]:
+        tariffs = await self.catalog.list_active(category, channel_name)
+        if self.catalog.version != self._version:
+            self._markups.clear()
+            self._version = self.catalog.version
+
+        key = (category, channel_name, lang)
+        if key not in self._markups:
+            self._markups[key] = build_plan_list_keyboard(tariffs) if tariffs else None
+        return self._markups[key]
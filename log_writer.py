@@ -0,0 +1,187 @@
+import os
+import json
+import asyncio
+import random
+import logging
+from collections import deque
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+HTTP_LOG_QUEUE_SIZE = int(os.getenv("HTTP_LOG_QUEUE_SIZE", 5000))
+HTTP_LOG_BATCH_SIZE = int(os.getenv("HTTP_LOG_BATCH_SIZE", 200))
+HTTP_LOG_FLUSH_INTERVAL = float(os.getenv("HTTP_LOG_FLUSH_INTERVAL", 2))
+HTTP_LOG_OVERFLOW = os.getenv("HTTP_LOG_OVERFLOW", "drop_oldest")  # drop_oldest | sample
+HTTP_LOG_SAMPLE_RATE = float(os.getenv("HTTP_LOG_SAMPLE_RATE", 0.1))
+HTTP_LOG_MAX_PAYLOAD = int(os.getenv("HTTP_LOG_MAX_PAYLOAD", 4096))  # байт
+HTTP_LOG_FIELDS = os.getenv("HTTP_LOG_FIELDS", "")  # allowlist полей payload через запятую, пусто = все
+# Доля логируемых запросов по префиксу пути, самый длинный префикс побеждает
+HTTP_LOG_PATH_RATES = os.getenv(
+    "HTTP_LOG_PATH_RATES",
+    "/webhook/cryptocloud=1,/webhook/tribute=1,/webhook=0.01,/metrics=0,/healthz=0,/readyz=0",
+)
+
+
+# --- SAMPLING ---
+def parse_rates(value: str) -> dict:
+    rates = {}
+    for item in value.split(","):
+        prefix, _, rate = item.strip().partition("=")
+        if prefix and rate:
+            rates[prefix.strip()] = float(rate)
+    return rates
+
+
+class LogSampler:
+    def __init__(self, rates: dict = None, default: float = 1.0):
+        self.default = default
+        # Длинные префиксы проверяем первыми
+        self.rates = sorted((rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    @classmethod
+    def from_env(cls) -> "LogSampler":
+        return cls(parse_rates(HTTP_LOG_PATH_RATES))
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default
+
+    def should_log(self, path: str) -> bool:
+        rate = self.rate_for(path)
+        return rate >= 1 or random.random() < rate
+
+
+# --- PAYLOAD ---
+# Только эти тела читаем для лога: остальные (multipart и т.п.) decode_payload всё равно не разбирает
+DECODABLE_CONTENT_TYPES = ("application/json", "application/x-www-form-urlencoded")
+
+
+def is_decodable(content_type: str) -> bool:
+    return any(kind in content_type for kind in DECODABLE_CONTENT_TYPES)
+
+def decode_payload(body: bytes, content_type: str, max_size: int = HTTP_LOG_MAX_PAYLOAD, fields=None):
+    # Разбираем сырое тело уже в фоновой задаче, а не во время обработки запроса
+    if not body:
+        return {}
+    if not is_decodable(content_type):
+        return {}
+    try:
+        if "application/json" in content_type:
+            payload = json.loads(body)
+        elif "application/x-www-form-urlencoded" in content_type:
+            payload = dict(parse_qsl(body.decode("utf-8", "replace")))
+    except ValueError:
+        return {}
+
+    if fields and isinstance(payload, dict):
+        payload = {key: value for key, value in payload.items() if key in fields}
+
+    if max_size and len(body) > max_size:
+        size = len(json.dumps(payload, ensure_ascii=False, default=str))
+        if size > max_size:
+            return {"_truncated": True, "_size": len(body)}
+    return payload
+
+
+class HttpLogWriter:
+    # Копит строки http_logs в памяти и пишет их пачками из фоновой задачи
+
+    def __init__(
+        self,
+        repository,
+        max_size: int = HTTP_LOG_QUEUE_SIZE,
+        batch_size: int = HTTP_LOG_BATCH_SIZE,
+        flush_interval: float = HTTP_LOG_FLUSH_INTERVAL,
+        overflow: str = HTTP_LOG_OVERFLOW,
+        sample_rate: float = HTTP_LOG_SAMPLE_RATE,
+        max_payload: int = HTTP_LOG_MAX_PAYLOAD,
+        fields: str = HTTP_LOG_FIELDS,
+    ):
+        if overflow not in ("drop_oldest", "sample"):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.repository = repository
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.max_payload = max_payload
+        self.fields = {field.strip() for field in fields.split(",") if field.strip()} or None
+
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+        self.written = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, row: dict):
+        if len(self._queue) >= self.max_size:
+            self.dropped += 1
+            if self.overflow == "drop_oldest":
+                self._queue.popleft()
+            elif random.random() < self.sample_rate:
+                # sample: новая строка вытесняет случайную из очереди
+                self._queue[random.randrange(len(self._queue))] = row
+                return
+            else:
+                return
+        self._queue.append(row)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        # Дописываем всё, что осталось в очереди
+        while self._queue:
+            await self.flush()
+
+    def prepare(self, row: dict) -> dict:
+        # В очереди лежит сырое тело запроса; в payload превращаем его только здесь
+        content_type = row.pop("content_type", "")
+        body = row.get("payload")
+        if isinstance(body, (bytes, bytearray)):
+            row["payload"] = decode_payload(body, content_type, self.max_payload, self.fields)
+        return row
+
+    async def flush(self):
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self.prepare(self._queue.popleft()))
+        if not batch:
+            return
+        try:
+            await self.repository.insert(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error("❌ Failed to write %s http_logs rows: %s", len(batch), e)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._queue:
+                await self.flush()
+                if len(self._queue) < self.batch_size:
+                    break
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# --- SETTINGS ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Формат: "<logger>=<LEVEL>,<logger>=<LEVEL>"; aiogram и access-лог aiohttp пишут по строке на каждый апдейт/запрос
+LOG_LEVELS = os.getenv("LOG_LEVELS", "aiogram.event=WARNING,aiohttp.access=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", 10))  # одинаковых WARNING/ERROR за окно, 0 — без лимита
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", 60))
+
+# Атрибуты LogRecord, которые не надо дублировать в JSON как extra-поля
+RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suppressed"}
+
+
+def parse_levels(value: str) -> dict:
+    levels = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, level = item.partition("=")
+        if not level:
+            raise ValueError(f"Invalid LOG_LEVELS entry: {item!r}")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class RepeatFilter(logging.Filter):
+    # Во время аварии одна и та же ошибка пишется на каждый запрос. Пропускаем limit записей
+    # с одного места (logger, строка, шаблон) за окно, остальные только считаем —
+    # их число попадёт в первую запись следующего окна.
+
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW, level: int = logging.WARNING):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.level = level
+        self._seen = {}  # key -> [window_started, count, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0 or record.levelno < self.level:
+            return True
+        key = (record.name, record.lineno, record.msg)  # msg — шаблон, аргументы не входят в ключ
+        now = time.monotonic()
+        entry = self._seen.get(key)
+        if entry is None or now - entry[0] >= self.window:
+            if entry is not None and entry[2]:
+                record.suppressed = entry[2]
+            if entry is None and len(self._seen) >= 10000:
+                self._seen = {k: e for k, e in self._seen.items() if now - e[0] < self.window}
+            self._seen[key] = [now, 1, 0]
+            return True
+        entry[1] += 1
+        if entry[1] <= self.limit:
+            return True
+        entry[2] += 1
+        return False
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, "suppressed", 0):
+            text += f" [+{record.suppressed} similar suppressed]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # logger.info("...", extra={"order_id": ...}) — поля попадают в JSON как есть
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LoopQueueHandler(QueueHandler):
+    # В event loop только кладём запись в очередь; форматирование и запись в stdout — в потоке listener'а.
+    # Очередь ограничена: если поток не успевает, записи выбрасываются, а не копятся в памяти.
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь ограничена: при остановке ждём места, а не падаем на Full
+        self.queue.put(self._sentinel)
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging(level: str = LOG_LEVEL, levels: str = LOG_LEVELS, fmt: str = LOG_FORMAT):
+    global _handler, _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    _handler = LoopQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(RepeatFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(level)
+    for name, logger_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = Listener(_handler.queue, stream)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    # Дописывает всё, что осталось в очереди; перед os._exit() вызывать вручную
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_queue_size() -> int:
+    return _handler.queue.qsize() if _handler is not None else 0
+
+
+def log_records_dropped() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+
+def _after_fork():
+    # Поток listener'а в дочерний процесс не копируется: заводим новую очередь и новый поток
+    global _listener
+    if _listener is None:
+        return
+    handlers = _listener.handlers
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = Listener(_handler.queue, *handlers)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_after_fork)
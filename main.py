@@ -1,16 +1,17 @@
 import os
 from datetime import datetime, timezone, timedelta
-from typing import Optional
-from uuid import uuid4
+from uuid import uuid4, uuid5, NAMESPACE_URL
 import asyncio
+import logging
 
 from aiohttp import web
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import setup_application
 from aiogram.methods import CreateChatInviteLink
 
 
@@ -18,7 +19,29 @@ import hmac
 import hashlib
 
 
-from supabase import create_client, Client
+from logs import setup_logging, log_queue_size, log_records_dropped
+from db import Database
+from log_writer import HttpLogWriter, LogSampler, is_decodable
+from cache import (
+    TariffCatalog, UserCache, IdempotencyCache, OpenInvoiceCache, ActiveSubscriptionIndex,
+    SUBSCRIPTION_INDEX_SYNC_INTERVAL,
+)
+from http_client import HttpClient
+from notifications import NotificationQueue
+from jobs import JobQueue
+from routing import ReplicaRouter, HOP_HEADER
+from scheduler import ExpiryScheduler, EXPIRY_RELOAD_INTERVAL
+from invites import InviteLinkPool
+from outbound import OutboundScheduler, send_priority, PRIORITY_ADMIN, TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST
+from broadcasts import BroadcastEngine
+from workers import run_workers, WEB_WORKERS
+from ingestion import QueuedRequestHandler
+from keyboards import get_main_keyboard, get_plan_detail_keyboard, PlanListKeyboards
+from metrics import (
+    registry, HTTP_LATENCY, HTTP_IN_FLIGHT, CRYPTOCLOUD_LATENCY, ERRORS, QUEUE_DEPTH, CACHE_EVENTS, UPDATE_EVENTS,
+    LOGS_DROPPED,
+    TelegramMetricsMiddleware, HandlerMetricsMiddleware,
+)
 
 import json  # ✅ понадобится для логирования payload
 
@@ -27,10 +50,22 @@ from html import escape
 
 import aiohttp
 
+# Логи уходят в очередь, в stdout их пишет отдельный поток
+setup_logging()
+logger = logging.getLogger("main")  # не __name__: при запуске скриптом это "__main__"
+
 CRYPTOCLOUD_API_KEY = os.getenv("CRYPTOCLOUD_API_KEY")
 CRYPTOCLOUD_SHOP_ID = os.getenv("CRYPTOCLOUD_SHOP_ID")
+# Базовые URL внешних API переопределяются для локальных стендов (bench/)
+CRYPTOCLOUD_API_URL = os.getenv("CRYPTOCLOUD_API_URL", "https://api.cryptocloud.plus/v2").rstrip("/")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
 
 TRIBUTE_API_SECRET = os.getenv("TRIBUTE_API_SECRET")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+EXPIRY_KICK_FROM_CHANNEL = os.getenv("EXPIRY_KICK_FROM_CHANNEL", "").lower() in ("1", "true", "yes")
+WEBHOOK_SYNC_RETRY_DELAY = float(os.getenv("WEBHOOK_SYNC_RETRY_DELAY", 2))
+WEBHOOK_SYNC_RETRY_MAX_DELAY = float(os.getenv("WEBHOOK_SYNC_RETRY_MAX_DELAY", 60))
+EVENT_CLAIM_LEASE = float(os.getenv("EVENT_CLAIM_LEASE", 120))  # после — событие упавшего процесса выполняем заново
 
 
 # --- ENVIRONMENT VARIABLES ---
@@ -41,9 +76,47 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
 # --- INIT ---
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
+bot = Bot(
+    token=BOT_TOKEN,
+    parse_mode=ParseMode.HTML,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)),
+)
 dp = Dispatcher(storage=MemoryStorage())
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Планировщик снаружи: метрики меряют сам вызов API, а не ожидание в очереди.
+# Глобальный лимит Telegram — на бота, поэтому при нескольких воркерах делим его поровну
+outbound = OutboundScheduler(
+    global_rate=TELEGRAM_GLOBAL_RATE / WEB_WORKERS,
+    global_burst=max(1.0, TELEGRAM_GLOBAL_BURST / WEB_WORKERS),
+)
+bot.session.middleware(outbound)
+bot.session.middleware(TelegramMetricsMiddleware())
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+db = Database(SUPABASE_URL, SUPABASE_KEY)
+log_writer = HttpLogWriter(db.http_logs)
+log_sampler = LogSampler.from_env()
+tariff_catalog = TariffCatalog(db.tariffs)
+plan_keyboards = PlanListKeyboards(tariff_catalog)
+user_cache = UserCache(db.users)
+idempotency = IdempotencyCache()
+open_invoices = OpenInvoiceCache(db.invoices)
+# С несколькими воркерами оплаты проходят и в соседних процессах: индекс и sweeper
+# подтягивают их из базы, а прерванные задачи очереди возвращает родитель до fork
+MULTI_WORKER = WEB_WORKERS > 1
+active_subscriptions = ActiveSubscriptionIndex(
+    db.subscriptions,
+    sync_interval=SUBSCRIPTION_INDEX_SYNC_INTERVAL if MULTI_WORKER else None,
+)
+http = HttpClient()
+jobs = JobQueue(recover=not MULTI_WORKER)
+expiry = ExpiryScheduler(
+    db.subscriptions,
+    reload_interval=min(EXPIRY_RELOAD_INTERVAL, 60) if MULTI_WORKER else EXPIRY_RELOAD_INTERVAL,
+)
+invites = InviteLinkPool(bot)
+broadcasts = BroadcastEngine(bot)
+# Хэш токена считаем один раз при старте
+router = ReplicaRouter.from_env(BOT_TOKEN, fallback_url=WEBHOOK_URL2)
 
 
 # --- NOTIFICATION BOT ---
@@ -51,44 +124,12 @@ NOTIFICATION_BOT_TOKEN = "474032968:AAEACo_X1sZvjcDtcDmxs2DqbZ7qjhum2fk"
 NOTIFICATION_CHAT_ID = "-4950094176"
 
 
-async def send_notification(message: str, try_count: int = 3):
-    url = f"https://api.telegram.org/bot{NOTIFICATION_BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": NOTIFICATION_CHAT_ID,
-        "text": message,
-        "parse_mode": "HTML",
-        "disable_web_page_preview": True
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        for attempt in range(try_count):
-            try:
-                async with session.post(url, json=payload, timeout=5) as resp:
-                    if resp.status == 200:
-                        return True
-                    elif attempt == try_count - 1:  # Последняя попытка
-                        error_text = await resp.text()
-                        print(f"❌ Final notification send failed: {error_text}")
-                        return False
-                    await asyncio.sleep(1)  # Пауза перед повторной попыткой
-            except Exception as e:
-                if attempt == try_count - 1:  # Последняя попытка
-                    print(f"❌ Final notification error: {e}")
-                    return False
-                await asyncio.sleep(1)
-    return False
-
-
+notifier = NotificationQueue(http, NOTIFICATION_BOT_TOKEN, NOTIFICATION_CHAT_ID, api_url=TELEGRAM_API_URL)
 
-# --- MENU ---
-def get_main_keyboard(lang: str, category: Optional[str]) -> ReplyKeyboardMarkup:
-    buttons = []
-    if category == "of":
-        label_sub = "Моя подписка" if lang == "ru" else "My subscription"
-        label_plans = "📋 Тарифы" if lang == "ru" else "📋 Plans"
-        buttons = [[KeyboardButton(text=label_sub)], [KeyboardButton(text=label_plans)]]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
+def send_notification(message: str):
+    # Не ждём доставки: сообщение уйдёт из фонового воркера
+    notifier.push(message)
 
 
 
@@ -100,6 +141,56 @@ def parse_start_param(param: str):
     return "of", parts[1] if len(parts) > 1 else None
 
 
+# --- HELPER: CONCURRENT LOOKUPS ---
+class LookupFailed(Exception):
+    # Обязательные данные не нашлись; reply — что ответить пользователю
+    def __init__(self, reply: str):
+        super().__init__(reply)
+        self.reply = reply
+
+
+async def require(awaitable, reply: str):
+    value = await awaitable
+    if not value:
+        raise LookupFailed(reply)
+    return value
+
+
+async def gather_or_cancel(*awaitables):
+    # Независимые чтения параллельно; первая ошибка отменяет остальные
+    tasks = [asyncio.ensure_future(aw) for aw in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+# --- METRICS MIDDLEWARE ---
+@web.middleware
+async def metrics_middleware(request, handler):
+    # Метка — шаблон маршрута, а не сырой путь, чтобы не плодить серии
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    status = 500
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with HTTP_IN_FLIGHT.track(route=route):
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            if status >= 500:
+                ERRORS.inc(component="http")
+            HTTP_LATENCY.observe(loop.time() - started, route=route, method=request.method, status=status)
+
+
 # --- LOGGING MIDDLEWARE ---
 @web.middleware
 async def logging_middleware(request, handler):
@@ -108,39 +199,34 @@ async def logging_middleware(request, handler):
         path = request.path
         ip = request.remote
         user_agent = request.headers.get("User-Agent", "")
-        
-        # <-- Правильное извлечение данных в зависимости от content-type
         content_type = request.headers.get("Content-Type", "")
-        if "application/json" in content_type:
-            try:
-                payload = await request.json()
-            except:
-                payload = {}
-        elif "application/x-www-form-urlencoded" in content_type:
-            try:
-                payload = dict(await request.post())
-            except:
-                payload = {}
-        else:
-            payload = {}
+
+        # Тело читаем один раз: aiohttp кэширует байты, и хендлер возьмёт их оттуда.
+        # Разбор JSON/формы для лога делает фоновый writer.
+        # Только JSON и urlencoded: после read() multipart-тела request.post() в хендлере
+        # (вебхук CryptoCloud) падает с "Could not find starting boundary" — такие пишем в лог как {}
+        sampled = log_sampler.should_log(path)
+        body = await request.read() if sampled and request.can_read_body and is_decodable(content_type) else b""
 
         response = await handler(request)
 
-        # логгируем
-        supabase.table("http_logs").insert({
-            "method": method,
-            "path": path,
-            "status_code": response.status,
-            "ip": ip,
-            "user_agent": user_agent,
-            "payload": payload,
-            "source": detect_source(path, user_agent)
-        }).execute()
+        # логгируем (запись в базу делает фоновая задача); ошибки — всегда
+        if sampled or response.status >= 500:
+            log_writer.push({
+                "method": method,
+                "path": path,
+                "status_code": response.status,
+                "ip": ip,
+                "user_agent": user_agent,
+                "payload": body,
+                "content_type": content_type,
+                "source": detect_source(path, user_agent)
+            })
 
         return response
 
     except Exception as e:
-        supabase.table("http_logs").insert({
+        log_writer.push({
             "method": request.method,
             "path": request.path,
             "status_code": 500,
@@ -148,7 +234,7 @@ async def logging_middleware(request, handler):
             "user_agent": request.headers.get("User-Agent", ""),
             "payload": {},
             "source": "error"
-        }).execute()
+        })
         raise
 
 
@@ -161,6 +247,22 @@ def detect_source(path: str, user_agent: str) -> str:
     return "unknown"
 
 
+# --- HELPER: SUBSCRIPTIONS TEXT ---
+async def format_subscriptions(subscriptions: list) -> str:
+    # Все тарифы берём одним обращением к каталогу, без запроса на каждую подписку
+    tariffs = await tariff_catalog.get_many(sub["tariff_id"] for sub in subscriptions)
+
+    msg_lines = []
+    for sub in subscriptions:
+        tariff = tariffs.get(str(sub["tariff_id"]))
+        if tariff:
+            title = tariff["title"]
+            channel_id = tariff.get("channel_id", "N/A")
+            ends_at = sub["ends_at"]
+            msg_lines.append(f"📦 <b>{escape(title)}</b>\n🗓 Ends at: {ends_at}\n🔗 Channel: {channel_id}")
+    return "\n\n".join(msg_lines)
+
+
 # --- COMMAND: /start ---
 
 @dp.message(F.text.startswith("/start"))
@@ -175,49 +277,35 @@ async def start_handler(message: Message):
         category, channel = parse_start_param(args[1])
 
     # Check if user is already registered
-    result = supabase.table("users").select("*").eq("id", user_id).execute()
-    if not result.data:
+    user = await user_cache.get(user_id)
+    if not user:
         if not category:
             error_text = "❌ Error. Message me: @jp_agency" if lang == "en" else "❌ Ошибка. Напишите мне в личку: @jp_agency"
             await message.answer(error_text)
             return
 
         # Register new user
-        supabase.table("users").insert({
+        await user_cache.create({
             "id": user_id,
             "lang": lang,
             "created_at": datetime.utcnow().isoformat(),
             "category": category,
             "channel": channel
-        }).execute()
+        })
     else:
-        lang = result.data[0]["lang"]
-        category = result.data[0]["category"]
-        channel = result.data[0]["channel"]
+        lang = user["lang"]
+        category = user["category"]
+        channel = user["channel"]
 
     # Основная клавиатура
     keyboard = get_main_keyboard(lang, category)
     await message.answer("💋 Hi!" if lang == "ru" else "💋 Hi!", reply_markup=keyboard)
 
-    # --- Получаем тарифы из supabase ---
-    tariffs = supabase.table("tariffs") \
-        .select("*") \
-        .eq("is_active", True) \
-        .eq("category", category) \
-        .eq("channel_name", channel) \
-        .execute().data
+    # --- Клавиатура тарифов (готовая, из кэша) ---
+    inline_kb = await plan_keyboards.get(category, channel, lang)
 
-    if tariffs:
+    if inline_kb:
         plan_text = "Выберите тариф 👇" if lang == "ru" else "Choose plan 👇"
-        buttons = []
-
-        for tariff in tariffs:
-            duration_days = int(tariff["lifetime"]) // 1440  # 60*24 = 1440 минут в дне
-            text = f"{tariff['title']} | {tariff['price']}$ | {duration_days} days"
-            callback_data = f"plan_{tariff['id']}"
-            buttons.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
-
-        inline_kb = InlineKeyboardMarkup(inline_keyboard=buttons)
         await message.answer(plan_text, reply_markup=inline_kb)
 
 
@@ -226,67 +314,36 @@ async def my_subscription_text_handler(message: Message):
     user_id = message.from_user.id
 
     # Получаем активные подписки (как ты уже делаешь)
-    subs_resp = supabase.table("subscriptions") \
-        .select("tariff_id, ends_at") \
-        .eq("user_id", user_id) \
-        .eq("status", "active") \
-        .execute()
+    subscriptions = await active_subscriptions.list_active(user_id)
 
-    if not subs_resp.data:
+    if not subscriptions:
         await message.answer("У вас нет активных подписок" if message.from_user.language_code == "ru" else "You have no active subscriptions")
         return
 
-    msg_lines = []
-    for sub in subs_resp.data:
-        tariff_resp = supabase.table("tariffs") \
-            .select("title", "channel_id") \
-            .eq("id", sub["tariff_id"]) \
-            .single() \
-            .execute()
-        if tariff_resp.data:
-            title = tariff_resp.data["title"]
-            channel_id = tariff_resp.data.get("channel_id", "N/A")
-            ends_at = sub["ends_at"]
-            msg_lines.append(f"📦 <b>{title}</b>\n🗓 Ends at: {ends_at}\n🔗 Channel: {channel_id}")
-
-    await message.answer("\n\n".join(msg_lines), parse_mode="HTML")
+    text = await format_subscriptions(subscriptions)
+    await message.answer(text, parse_mode="HTML")
 
 @dp.message(F.text.in_(["📋 Тарифы", "📋 Plans"]))
 async def plans_text_handler(message: Message):
     user_id = message.from_user.id
 
-    user_resp = supabase.table("users").select("*").eq("id", user_id).single().execute()
-    if not user_resp.data:
+    user = await user_cache.get(user_id)
+    if not user:
         await message.answer("❌ Ошибка. Напишите мне: @jp_agency")
         return
 
-    user = user_resp.data
     lang = user["lang"]
     category = user["category"]
     channel = user["channel"]
 
     # Получаем тарифы
-    tariffs = supabase.table("tariffs") \
-        .select("*") \
-        .eq("is_active", True) \
-        .eq("category", category) \
-        .eq("channel_name", channel) \
-        .execute().data
-
-    if not tariffs:
+    inline_kb = await plan_keyboards.get(category, channel, lang)
+
+    if not inline_kb:
         await message.answer("❌ Нет доступных тарифов." if lang == "ru" else "❌ No active plans available.")
         return
 
     plan_text = "Выберите тариф 👇" if lang == "ru" else "Choose plan 👇"
-    buttons = []
-
-    for tariff in tariffs:
-        duration_days = int(tariff["lifetime"]) // 1440
-        text = f"{tariff['title']} | {tariff['price']}$ | {duration_days} days"
-        callback_data = f"plan_{tariff['id']}"
-        buttons.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
-
-    inline_kb = InlineKeyboardMarkup(inline_keyboard=buttons)
     await message.answer(plan_text, reply_markup=inline_kb)
 
 
@@ -297,19 +354,17 @@ async def plan_detail_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
 
     # Получаем пользователя
-    result = supabase.table("users").select("*").eq("id", user_id).execute()
-    if not result.data:
+    user = await user_cache.get(user_id)
+    if not user:
         await callback.answer("❌ Error. User not found.")
         return
-    user = result.data[0]
     lang = user["lang"]
 
     # Получаем тариф
-    tariff_resp = supabase.table("tariffs").select("*").eq("id", tariff_id).single().execute()
-    if not tariff_resp.data:
+    tariff = await tariff_catalog.get(tariff_id)
+    if not tariff:
         await callback.answer("❌ Tariff not found")
         return
-    tariff = tariff_resp.data
 
     duration_days = int(tariff["lifetime"]) // 1440
     text = (
@@ -321,16 +376,7 @@ async def plan_detail_handler(callback: CallbackQuery):
     )
 
     # Инлайн-кнопки: оплата
-    buttons = [
-        [
-            InlineKeyboardButton(text="💳 Pay by card", callback_data=f"pay_card_{tariff_id}"),
-            InlineKeyboardButton(text="🪙 Pay by crypto", callback_data=f"pay_crypto_{tariff_id}")
-        ],
-        [
-            InlineKeyboardButton(text="🔙 Back", callback_data="back_to_plans")
-        ]
-    ]
-    kb = InlineKeyboardMarkup(inline_keyboard=buttons)
+    kb = get_plan_detail_keyboard(tariff_id)
 
     # Удаляем/редактируем старое сообщение
     await callback.message.edit_text(text, reply_markup=kb)
@@ -342,32 +388,27 @@ async def card_payment_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
     tariff_id = callback.data.split("_", 2)[2]
 
-    # Получаем пользователя
-    user_resp = supabase.table("users").select("lang").eq("id", user_id).single().execute()
-    lang = user_resp.data["lang"] if user_resp.data else "en"
+    # Пользователь, тариф и проверка активной подписки — параллельно
+    try:
+        user, tariff, already_active = await gather_or_cancel(
+            user_cache.get(user_id),
+            require(tariff_catalog.get(tariff_id), "❌ Tariff not found"),
+            active_subscriptions.has_active(user_id, tariff_id),
+        )
+    except LookupFailed as e:
+        await callback.message.answer(e.reply)
+        await callback.answer()
+        return
+    lang = user["lang"] if user else "en"
 
     # Проверка на активную подписку
-    existing_sub = supabase.table("subscriptions") \
-        .select("*") \
-        .eq("user_id", user_id) \
-        .eq("tariff_id", tariff_id) \
-        .eq("status", "active") \
-        .execute()
-
-    if existing_sub.data:
+    if already_active:
         msg = "❌ У вас уже есть активная подписка на этот тариф." if lang == "ru" else "❌ You already have an active subscription to this plan."
         await callback.message.answer(msg)
         await callback.answer()
         return
 
-    # Получаем тариф
-    tariff_resp = supabase.table("tariffs").select("tribute_link", "title").eq("id", tariff_id).single().execute()
-    if not tariff_resp.data:
-        await callback.message.answer("❌ Tariff not found")
-        await callback.answer()
-        return
-
-    tribute_link = tariff_resp.data.get("tribute_link")
+    tribute_link = tariff.get("tribute_link")
     if not tribute_link:
         await callback.message.answer("❌ No payment link available")
         await callback.answer()
@@ -390,86 +431,34 @@ async def card_payment_handler(callback: CallbackQuery):
 async def back_to_plan_list(callback: CallbackQuery):
     user_id = callback.from_user.id
 
-    result = supabase.table("users").select("*").eq("id", user_id).execute()
-    if not result.data:
+    user = await user_cache.get(user_id)
+    if not user:
         await callback.answer("❌ User not found")
         return
-    user = result.data[0]
     lang = user["lang"]
     category = user["category"]
     channel = user["channel"]
 
     # Получаем тарифы
-    tariffs = supabase.table("tariffs") \
-        .select("*") \
-        .eq("is_active", True) \
-        .eq("category", category) \
-        .eq("channel_name", channel) \
-        .execute().data
-
-    if not tariffs:
+    inline_kb = await plan_keyboards.get(category, channel, lang)
+
+    if not inline_kb:
         await callback.message.edit_text("❌ No active plans available.")
         return
 
     plan_text = "Выберите тариф 👇" if lang == "ru" else "Choose plan 👇"
-    buttons = []
-
-    for tariff in tariffs:
-        duration_days = int(tariff["lifetime"]) // 1440
-        text = f"{tariff['title']} | {tariff['price']}$ | {duration_days} days"
-        callback_data = f"plan_{tariff['id']}"
-        buttons.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
-
-    inline_kb = InlineKeyboardMarkup(inline_keyboard=buttons)
     await callback.message.edit_text(plan_text, reply_markup=inline_kb)
     await callback.answer()
 
 
 
-@dp.callback_query(F.data.startswith("pay_crypto_"))
-async def crypto_payment_handler(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    tariff_id = callback.data.split("_", 2)[2]
-
-    # Получаем пользователя
-    user_result = supabase.table("users").select("*").eq("id", user_id).execute()
-    if not user_result.data:
-        await callback.answer("❌ User not found")
-        return
-    user = user_result.data[0]
-    lang = user["lang"]
-    locale = lang
-
-    # Получаем тариф
-    tariff_result = supabase.table("tariffs").select("*").eq("id", tariff_id).single().execute()
-    if not tariff_result.data:
-        await callback.answer("❌ Tariff not found")
-        return
-    tariff = tariff_result.data
-
-# ⛔️ Проверка на существующую активную подписку
-    existing_sub = supabase.table("subscriptions") \
-        .select("*") \
-        .eq("user_id", user_id) \
-        .eq("tariff_id", tariff_id) \
-        .eq("status", "active") \
-        .execute()
-
-    
-    if existing_sub.data:
-        msg = "❌ У вас уже есть активная подписка на этот тариф." if lang == "ru" else "❌ You already have an active subscription to this plan."
-        await callback.message.answer(msg)
-        await callback.answer()
-        return
-
-    amount = float(tariff["price"])
-
-    # В crypto_payment_handler
-    bot_token_hash = hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:8]  # Первые 8 символов хэша токена
-    order_id = f"{user_id}-{tariff_id}-{int(datetime.utcnow().timestamp())}-{bot_token_hash}"
+async def create_crypto_invoice(user_id, tariff_id, amount: float, locale: str):
+    # Новый счёт в CryptoCloud + запись в invoices; возвращает (invoice, текст ошибки)
+    # Суффикс order_id — первые 8 символов хэша токена, по нему вебхук находит реплику
+    order_id = router.make_order_id(user_id, tariff_id, int(datetime.utcnow().timestamp()))
 
     # --- Запрос в CryptoCloud ---
-    url = "https://api.cryptocloud.plus/v2/invoice/create"
+    url = f"{CRYPTOCLOUD_API_URL}/invoice/create"
     headers = {
     "Authorization": f"Token {CRYPTOCLOUD_API_KEY}",
     "Content-Type": "application/json"
@@ -486,41 +475,86 @@ async def crypto_payment_handler(callback: CallbackQuery):
     "order_id": order_id  # ← здесь мы вставляем значение переменной
 }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status != 200:
-                await callback.message.answer("❌ Ошибка при создании счета")
-                return
-            resp_data = await response.json()
-            pay_link = resp_data.get("result", {}).get("link")
-            if pay_link:
-                separator = "&" if "?" in pay_link else "?"
-                pay_link += f"{separator}lang={locale}"
-            
-            if not pay_link:
-                await callback.message.answer("❌ Не удалось получить ссылку на оплату")
+    with CRYPTOCLOUD_LATENCY.time(endpoint="invoice/create"):
+        async with http.post(url, headers=headers, json=payload) as response:
+            status = response.status
+            resp_data = await response.json() if status == 200 else None
+    if status != 200:
+        ERRORS.inc(component="cryptocloud")
+        return None, "❌ Ошибка при создании счета"
+
+    pay_link = resp_data.get("result", {}).get("link")
+    if pay_link:
+        separator = "&" if "?" in pay_link else "?"
+        pay_link += f"{separator}lang={locale}"
+    
+    if not pay_link:
+        return None, "❌ Не удалось получить ссылку на оплату"
+
+    # Сохраняем в Supabase
+    invoice = await db.invoices.create({
+        "id": str(uuid4()),
+        "user_id": user_id,
+        "tariff_id": tariff_id,
+        "order_id": order_id,  # ← правильно
+        "invoice_link": pay_link,
+        "amount": amount,
+        "currency": "USD",
+        "status": "created",
+        "raw_response": resp_data,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    open_invoices.put(invoice)
+    return invoice, None
+
+
+@dp.callback_query(F.data.startswith("pay_crypto_"))
+async def crypto_payment_handler(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    tariff_id = callback.data.split("_", 2)[2]
+
+    # Пользователь, тариф и проверка активной подписки — параллельно
+    try:
+        user, tariff, already_active = await gather_or_cancel(
+            require(user_cache.get(user_id), "❌ User not found"),
+            require(tariff_catalog.get(tariff_id), "❌ Tariff not found"),
+            active_subscriptions.has_active(user_id, tariff_id),
+        )
+    except LookupFailed as e:
+        await callback.answer(e.reply)
+        return
+    lang = user["lang"]
+    locale = lang
+
+# ⛔️ Проверка на существующую активную подписку
+    if already_active:
+        msg = "❌ У вас уже есть активная подписка на этот тариф." if lang == "ru" else "❌ You already have an active subscription to this plan."
+        await callback.message.answer(msg)
+        await callback.answer()
+        return
+
+    amount = float(tariff["price"])
+
+    async with open_invoices.lock(user_id, tariff_id):
+        # Повторное нажатие: отдаём ещё не оплаченный счёт вместо нового invoice/create
+        invoice = await open_invoices.get(user_id, tariff_id)
+        if invoice is not None and float(invoice["amount"]) != amount:
+            # Цена тарифа изменилась — старый счёт не отдаём
+            open_invoices.discard(user_id, tariff_id)
+            invoice = None
+        if invoice is None:
+            invoice, error = await create_crypto_invoice(user_id, tariff_id, amount, locale)
+            if error:
+                await callback.message.answer(error)
                 return
+    pay_link = invoice["invoice_link"]
 
-            # Сохраняем в Supabase
-            supabase.table("invoices").insert({
-                "id": str(uuid4()),
-                "user_id": user_id,
-                "tariff_id": tariff_id,
-                "order_id": order_id,  # ← правильно
-                "invoice_link": pay_link,
-                "amount": amount,
-                "currency": "USD",
-                "status": "created",
-                "raw_response": resp_data
-            }).execute()
-
-
-            await callback.message.answer(
-                "🪙 <b>Оплатите по ссылке:</b>\n" + pay_link if lang == "ru"
-                else "🪙 <b>Pay with crypto:</b>\n" + pay_link,
-                parse_mode="HTML"
-            )
-            await callback.answer()
+    await callback.message.answer(
+        "🪙 <b>Оплатите по ссылке:</b>\n" + pay_link if lang == "ru"
+        else "🪙 <b>Pay with crypto:</b>\n" + pay_link,
+        parse_mode="HTML"
+    )
+    await callback.answer()
 
 
 
@@ -528,12 +562,11 @@ async def crypto_payment_handler(callback: CallbackQuery):
 @dp.message()
 async def fallback_handler(message: Message):
     user_id = message.from_user.id
-    result = supabase.table("users").select("*").eq("id", user_id).execute()
-    if not result.data:
+    user = await user_cache.get(user_id)
+    if not user:
         await message.answer("❌ Ошибка. Напишите мне в личку: @jp_agency")
         return
 
-    user = result.data[0]
     lang = user["lang"]
     category = user["category"]
     keyboard = get_main_keyboard(lang, category)
@@ -546,30 +579,13 @@ async def my_subscription_handler(callback: CallbackQuery):
     user_id = callback.from_user.id
 
     # Получаем все активные подписки пользователя
-    subs_resp = supabase.table("subscriptions") \
-        .select("tariff_id, ends_at") \
-        .eq("user_id", user_id) \
-        .eq("status", "active") \
-        .execute()
+    subscriptions = await active_subscriptions.list_active(user_id)
 
-    if not subs_resp.data or len(subs_resp.data) == 0:
+    if not subscriptions:
         await callback.answer("У вас нет активных подписок" if callback.from_user.language_code == "ru" else "You have no active subscriptions", show_alert=True)
         return
 
-    msg_lines = []
-    for sub in subs_resp.data:
-        tariff_resp = supabase.table("tariffs") \
-            .select("title", "channel_id") \
-            .eq("id", sub["tariff_id"]) \
-            .single() \
-            .execute()
-        if tariff_resp.data:
-            title = tariff_resp.data["title"]
-            channel_id = tariff_resp.data.get("channel_id", "N/A")
-            ends_at = sub["ends_at"]
-            msg_lines.append(f"📦 <b>{escape(title)}</b>\n🗓 Ends at: {ends_at}\n🔗 Channel: {channel_id}")
-
-    text = "\n\n".join(msg_lines)
+    text = await format_subscriptions(subscriptions)
 
     await callback.message.answer(text, parse_mode="HTML")
     await callback.answer()
@@ -577,15 +593,593 @@ async def my_subscription_handler(callback: CallbackQuery):
 
 # --- WEBHOOK SETUP ---
 async def on_startup(app: web.Application):
+    # Singleton-задачи (вебхук, sweeper подписок, рассылки) — только в primary-воркере
+    primary = app["primary"]
+    app["outbound"].start()
+    app["http"].start()
+    app["log_writer"].start()
+    app["notifier"].start()
+    await app["jobs"].start()
+    if primary:
+        app["expiry"].start()
+    app["active_subscriptions"].start()
+    app["invites"].start()
+    await app["broadcasts"].start(run=primary)
+    app["updates"].start()
+    # Прогрев не держит старт: сервер сразу отвечает на /healthz, а /readyz ждёт прогрева
+    app["warm_up"] = asyncio.create_task(warm_up(app))
+
+
+async def sync_webhook():
+    # set_webhook только если Telegram знает другой URL — на обычном рестарте вызов не нужен
+    try:
+        info = await bot.get_webhook_info()
+        if info.url == WEBHOOK_URL:
+            return
+    except Exception as e:
+        logger.warning("⚠️ get_webhook_info failed, setting webhook anyway: %s", e)
     await bot.set_webhook(WEBHOOK_URL)
+    logger.info("🔗 Webhook set to %s", WEBHOOK_URL)
 
 
-async def tribute_webhook_handler(request: web.Request, bot: Bot):
+async def warm_up(app: web.Application):
+    try:
+        await app["tariff_catalog"].ensure_fresh()
+    except Exception as e:
+        logger.error("❌ Failed to preload tariffs: %s", e)
+    if not app["primary"]:
+        app["readiness"]["webhook"] = True
+        return
+    # Без вебхука /readyz не пустит трафик — повторяем, пока Telegram не ответит (отменяется в on_shutdown)
+    delay = WEBHOOK_SYNC_RETRY_DELAY
+    while True:
+        try:
+            await sync_webhook()
+            app["readiness"]["webhook"] = True
+            return
+        except Exception as e:
+            logger.error("❌ Failed to set webhook, retry in %.0fs: %s", delay, e)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WEBHOOK_SYNC_RETRY_MAX_DELAY)
+
+
+async def on_shutdown(app: web.Application):
+    # aiohttp до on_cleanup ждёт (до shutdown_timeout) все задачи, запущенные после старта,
+    # поэтому фоновые циклы останавливаем здесь. Запросы ещё дорабатывают: очередь задач,
+    # логи и уведомления принимают записи до on_cleanup
+    if not app["warm_up"].done():
+        app["warm_up"].cancel()
+    # Сначала дорабатываем принятые апдейты: им ещё нужны очередь задач и исходящие вызовы
+    await app["updates"].stop()
+    await app["broadcasts"].stop()
+    await app["invites"].stop()
+    await app["expiry"].stop()
+    await app["active_subscriptions"].stop()
+    await app["jobs"].stop()
+    await app["notifier"].stop()
+    await app["log_writer"].stop()
+    await app["outbound"].stop()
+
+
+async def on_cleanup(app: web.Application):
+    # Досылаем то, что пришло от запросов после on_shutdown, и закрываем ресурсы
+    await app["notifier"].stop()
+    await app["log_writer"].stop()
+    await app["jobs"].close()
+    await app["broadcasts"].close()
+    await app["db"].close()
+    await app["http"].close()
+
+
+def is_admin_request(request: web.Request) -> bool:
+    # Prometheus умеет слать только Authorization: Bearer
+    token = request.headers.get("X-Admin-Token", "")
+    if not token and request.headers.get("Authorization", "").startswith("Bearer "):
+        token = request.headers["Authorization"][len("Bearer "):]
+    return hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+async def invalidate_tariffs_handler(request: web.Request):
+    # Сбрасываем кэш тарифов после правок в Supabase
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    request.app["tariff_catalog"].invalidate()
+    plan_keyboards.invalidate()
+    return web.json_response({"ok": True})
+
+
+async def cache_stats_handler(request: web.Request):
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    return web.json_response({
+        "ok": True,
+        "users": request.app["user_cache"].stats(),
+        "tariffs": {
+            "size": len(request.app["tariff_catalog"].by_id),
+            "version": request.app["tariff_catalog"].version,
+        },
+        "invites": request.app["invites"].stats(),
+    })
+
+
+async def jobs_stats_handler(request: web.Request):
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    return web.json_response({"ok": True, "jobs": await request.app["jobs"].stats()})
+
+
+async def collect_runtime_metrics():
+    QUEUE_DEPTH.set(len(log_writer), queue="http_logs")
+    QUEUE_DEPTH.set(len(notifier), queue="notifications")
+    QUEUE_DEPTH.set(len(expiry), queue="expiry")
+    CACHE_EVENTS.set_total(user_cache.hits, cache="users", event="hits")
+    CACHE_EVENTS.set_total(user_cache.misses, cache="users", event="misses")
+    CACHE_EVENTS.set_total(user_cache.evictions, cache="users", event="evictions")
+    CACHE_EVENTS.set_total(idempotency.duplicates, cache="idempotency", event="duplicates")
+    CACHE_EVENTS.set_total(open_invoices.hits, cache="open_invoices", event="hits")
+    CACHE_EVENTS.set_total(open_invoices.misses, cache="open_invoices", event="misses")
+    QUEUE_DEPTH.set(len(invites), queue="invite_links")
+    QUEUE_DEPTH.set(len(outbound), queue="telegram_outbound")
+    QUEUE_DEPTH.set(len(updates), queue="updates")
+    QUEUE_DEPTH.set(log_queue_size(), queue="logs")
+    LOGS_DROPPED.set_total(log_records_dropped())
+    for event in ("accepted", "rejected", "shed", "processed", "failed"):
+        UPDATE_EVENTS.set_total(getattr(updates, event), event=event)
+    CACHE_EVENTS.set_total(invites.hits, cache="invite_links", event="hits")
+    CACHE_EVENTS.set_total(invites.misses, cache="invite_links", event="misses")
+    # SQLite-запрос последним: если он упадёт, остальные значения уже обновлены
+    QUEUE_DEPTH.set((await jobs.stats())["pending"], queue="jobs")
+
+
+registry.add_collector(collect_runtime_metrics)
+
+
+async def metrics_handler(request: web.Request):
+    # Без ADMIN_TOKEN эндпоинт открыт — удобно для локального Prometheus
+    if ADMIN_TOKEN and not is_admin_request(request):
+        return web.Response(status=403, text="Forbidden")
+    await registry.collect()
+    return web.Response(
+        body=registry.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def create_broadcast_handler(request: web.Request):
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    data = await request.json()
+    kind = data.get("kind")
+    if kind == "renewal_reminder":
+        # Окно в сутки: при ежедневном запуске каждое окончание напоминается один раз
+        days = float(data.get("days", 3))
+        now = datetime.now(timezone.utc)
+        params = {
+            "since": (now + timedelta(days=days - 1)).isoformat(),
+            "until": (now + timedelta(days=days)).isoformat(),
+        }
+    elif kind == "tariff_announcement":
+        if not data.get("text"):
+            return web.json_response({"ok": False, "error": "Missing text"}, status=400)
+        params = {key: data[key] for key in ("category", "channel", "tariff_id", "text", "text_ru", "text_en") if key in data}
+    else:
+        return web.json_response({"ok": False, "error": f"Unknown kind {kind!r}"}, status=400)
+    broadcast_id = await request.app["broadcasts"].create(kind, params)
+    return web.json_response({"ok": True, "id": broadcast_id})
+
+
+async def list_broadcasts_handler(request: web.Request):
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    return web.json_response({"ok": True, "broadcasts": await request.app["broadcasts"].list()})
+
+
+async def get_broadcast_handler(request: web.Request):
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    broadcast = await request.app["broadcasts"].get(int(request.match_info["id"]))
+    if broadcast is None:
+        return web.json_response({"ok": False, "error": "Not found"}, status=404)
+    return web.json_response({"ok": True, "broadcast": broadcast})
+
+
+async def cancel_broadcast_handler(request: web.Request):
+    if not is_admin_request(request):
+        return web.json_response({"ok": False, "error": "Forbidden"}, status=403)
+    cancelled = await request.app["broadcasts"].cancel(int(request.match_info["id"]))
+    return web.json_response({"ok": cancelled})
+
+
+async def healthz_handler(request: web.Request):
+    # Liveness: процесс жив и event loop отвечает
+    return web.json_response({"ok": True})
+
+
+async def readyz_handler(request: web.Request):
+    # Readiness: балансировщик пускает трафик только на прогретый процесс
+    catalog = request.app["tariff_catalog"]
+    if catalog.version == 0:
+        # Прогрев не смог загрузить тарифы — пробуем ещё раз, не дольше секунды
+        try:
+            await asyncio.wait_for(catalog.ensure_fresh(), timeout=1)
+        except Exception:
+            pass
+    checks = {
+        "webhook": request.app["readiness"]["webhook"],
+        "tariffs": catalog.version > 0,
+        "subscriptions": request.app["active_subscriptions"].loaded,
+    }
+    ready = all(checks.values())
+    return web.json_response({"ok": ready, "checks": checks}, status=200 if ready else 503)
+
+
+# --- PAYMENT JOBS ---
+def instant_key(value) -> str:
+    # Один и тот же момент в разной записи ("Z" / "+00:00") — один ключ события
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return str(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat()
+
+
+async def claim_event(event_id: str) -> bool:
+    # Атомарная заявка в processed_events: False — событие уже выполнено.
+    # Если его прямо сейчас выполняет другой воркер или реплика — исключение,
+    # очередь задач повторит попытку и увидит результат
+    state = await db.processed_events.claim(event_id, EVENT_CLAIM_LEASE)
+    if state == "busy":
+        raise RuntimeError(f"Event {event_id} is being processed elsewhere")
+    return state == "claimed"
+
+
+async def process_tribute_event(data: dict):
+    event_name = data.get("name")
+    payload = data.get("payload", {})
+    telegram_user_id = payload.get("telegram_user_id")
+
+    # Получаем язык пользователя из базы
+    user = await user_cache.get(telegram_user_id)
+
+    lang = "en"  # значение по умолчанию
+    if user:
+        lang = user.get("lang", "en")
+
+    if event_name == "new_subscription":
+        subscription_id = payload.get("subscription_id")
+        subscription_name = payload.get("subscription_name")
+        expires_at = payload.get("expires_at")
+
+        # Находим тариф по subscription_name (соответствует title в таблице тарифов)
+        tariff = await tariff_catalog.get_by_title(subscription_name)
+
+        if not tariff:
+            logger.error("❌ Tariff not found for subscription_name: %s", subscription_name)
+            return
+
+        # Повторная или параллельная доставка того же продления выполняется один раз.
+        # Выполненным событие считается только после отправки сообщений (complete ниже)
+        event_id = f"tribute:{telegram_user_id}:{subscription_id}:{instant_key(expires_at)}"
+        if not await claim_event(event_id):
+            logger.info("↩️ Tribute subscription %s until %s already processed, skipping.", subscription_id, expires_at)
+            return
+
+        tariff_id = tariff["id"]
+        channel_id = tariff.get("channel_id")
+        started_at = datetime.now(timezone.utc).isoformat()
+
+        # Обновляем или создаем подписку
+        try:
+            subscription = await db.subscriptions.upsert({
+                "id": subscription_id,
+                "user_id": telegram_user_id,
+                "tariff_id": tariff_id,
+                "started_at": started_at,
+                "ends_at": expires_at,
+                "status": "active",
+                "price": payload.get("price"),
+                "currency": payload.get("currency"),
+                "updated_at": started_at
+            })
+        except Exception:
+            await db.processed_events.release(event_id)
+            raise
+        expiry.schedule(subscription)
+        active_subscriptions.add(subscription)
+
+        # Формируем сообщения на нужном языке
+        if lang == "ru":
+            success_msg = (
+                f"🎉 Подписка активирована!\n\n"
+                f"📝 Тариф: {subscription_name}\n"
+                f"💰 Стоимость: {payload.get('amount')} {payload.get('currency')}\n"
+                f"⏳ Действует до: {expires_at}"
+            )
+            invite_msg = f"🔗 Ссылка для вступления: {{link}}"
+        else:
+            success_msg = (
+                f"🎉 Subscription activated!\n\n"
+                f"📝 Plan: {subscription_name}\n"
+                f"💰 Amount: {payload.get('amount')} {payload.get('currency')}\n"
+                f"⏳ Valid until: {expires_at}"
+            )
+            invite_msg = f"🔗 Invite link: {{link}}"
+
+        # Отправляем сообщение пользователю
+        try:
+            await bot.send_message(chat_id=telegram_user_id, text=success_msg)
+
+            # Если есть channel_id, выдаём одноразовую ссылку из пула
+            if channel_id:
+                invite_link = await invites.take(channel_id)
+                await bot.send_message(
+                    chat_id=telegram_user_id,
+                    text=invite_msg.format(link=invite_link)
+                )
+        except Exception as e:
+            logger.error("❌ Error sending message: %s", e)
+
+        # Отправляем уведомление
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        notification_msg = (
+            "🆕 <b>New Tribute subscription</b>\n"
+            f"📅 <b>Date:</b> {now}\n"
+            f"👤 <b>User ID:</b> {telegram_user_id}\n"
+            f"📝 <b>Plan:</b> {subscription_name}\n"
+            f"💰 <b>Amount:</b> {payload.get('amount')} {payload.get('currency')}\n"
+            f"⏳ <b>Valid until:</b> {expires_at}"
+        )
+        send_notification(notification_msg)
+        await db.processed_events.complete(event_id)
+
+    elif event_name == "cancelled_subscription":
+        # Обработка отмены подписки с учетом языка
+        subscription_name = payload.get("subscription_name", "")
+        cancel_reason = payload.get("cancel_reason", "")
+
+        if lang == "ru":
+            msg = (
+                f"❌ Ваша подписка отменена\n\n"
+                f"📝 Тариф: {subscription_name}\n"
+                f"📌 Причина: {cancel_reason or 'не указана'}"
+            )
+        else:
+            msg = (
+                f"❌ Your subscription has been cancelled\n\n"
+                f"📝 Plan: {subscription_name}\n"
+                f"📌 Reason: {cancel_reason or 'not specified'}"
+            )
+
+        try:
+            await bot.send_message(chat_id=telegram_user_id, text=msg)
+        except Exception as e:
+            logger.error("❌ Error sending cancellation message: %s", e)
+
+
+async def process_crypto_payment(data: dict):
+    order_id = data["order_id"]
+
+    # Обновляем invoice
+    invoice = await db.invoices.mark_paid(order_id, datetime.utcnow().isoformat())
+
+    if not invoice:
+        # Счёт мог ещё не доехать до базы — пусть очередь повторит попытку
+        raise LookupError(f"Invoice {order_id} not found in database")
+
+    logger.info("✅ Invoice %s marked as paid.", order_id)
+    open_invoices.discard(invoice["user_id"], invoice["tariff_id"])
+
+    # Подписка, сообщения и ссылка — один раз на заказ, даже при параллельных доставках.
+    # Выполненным заказ считается только после отправки (complete ниже)
+    event_id = f"cryptocloud:{order_id}"
+    if not await claim_event(event_id):
+        logger.info("↩️ Order %s already fulfilled, skipping.", order_id)
+        return
+
+    # --- Получаем user_id, tariff_id из invoices ---
+    user_id = invoice["user_id"]
+    tariff_id = invoice["tariff_id"]
+
+    # --- Получаем lang пользователя ---
+    user = await user_cache.get(user_id)
+    lang = user["lang"] if user else "en"
+
+    # --- Получаем тариф для времени подписки и канала ---
+    tariff = await tariff_catalog.get(tariff_id)
+
+    if tariff:
+        lifetime_min = int(tariff["lifetime"])
+        channel_id = tariff.get("channel_id")
+
+        started_at = datetime.utcnow()
+        ends_at = started_at + timedelta(minutes=lifetime_min)
+
+        # --- Создаем запись подписки ---
+        # id выводится из order_id: если прошлая попытка упала после вставки, строка уже есть — это не повтор заказа
+        sub_id = str(uuid5(NAMESPACE_URL, f"cryptocloud:{order_id}"))
+        try:
+            created = await db.subscriptions.create_once({
+                "id": sub_id,
+                "user_id": user_id,
+                "tariff_id": tariff_id,
+                "order_id": order_id,
+                "started_at": started_at.isoformat(),
+                "ends_at": ends_at.isoformat(),
+                "status": "active",
+                "created_at": started_at.isoformat()
+                # "invoice_id": invoice_id
+            })
+        except Exception:
+            await db.processed_events.release(event_id)
+            raise
+        subscription = {"id": sub_id, "user_id": user_id, "tariff_id": tariff_id, "ends_at": ends_at.isoformat()}
+        if not created:
+            # Прошлая попытка упала после вставки — срок берём из уже созданной строки
+            subscription = await db.subscriptions.get(sub_id) or subscription
+        expiry.schedule(subscription)
+        active_subscriptions.add(subscription)
+
+    # --- Отправляем сообщение пользователю ---
+    try:
+        msg_text = "✅ Оплата прошла успешно!" if lang == "ru" else "✅ Payment successful!"
+        await bot.send_message(chat_id=user_id, text=msg_text)
+    except Exception as e:
+        logger.error("❌ Error sending payment success message to user %s: %s", user_id, e)
+
+    if not tariff:
+        logger.warning("⚠️ Tariff %s not found.", tariff_id)
+        await db.processed_events.complete(event_id)
+        return
+
+    # --- Создаем invite ссылку для канала и отправляем ---
+    if channel_id:
+        try:
+            # Одноразовая ссылка из заранее созданного пула
+            invite_link = await invites.take(channel_id)
+            invite_msg = (
+                f"📢 Вы получили доступ к каналу по подписке: {tariff['title']}\n\n"
+                f"Ссылка для вступления: {invite_link}"
+                if lang == "ru" else
+                f"📢 You have been granted access to the channel for your subscription: {tariff['title']}\n\n"
+                f"Invite link: {invite_link}"
+            )
+            await bot.send_message(chat_id=user_id, text=invite_msg)
+
+        except Exception as e:
+            logger.error("❌ Error creating or sending invite link for user %s: %s", user_id, e)
+
+    # Отправляем уведомление
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    notification_msg = (
+        "🆕 <b>New Crypto subscription</b>\n"
+        f"📅 <b>Date:</b> {now}\n"
+        f"👤 <b>User ID:</b> {user_id}\n"
+        f"📝 <b>Plan:</b> {tariff['title']}\n"
+        f"💰 <b>Amount:</b> {invoice['amount']} {invoice['currency']}\n"
+        f"⏳ <b>Valid until:</b> {ends_at.isoformat()}"
+    )
+    send_notification(notification_msg)
+    await db.processed_events.complete(event_id)
+
+
+jobs.register("tribute_event", process_tribute_event)
+jobs.register("crypto_payment", process_crypto_payment)
+
+
+# --- SUBSCRIPTION EXPIRY ---
+async def on_subscriptions_expired(subscriptions: list):
+    active_subscriptions.remove(subscriptions)
+    await remove_expired_members(subscriptions)
+
+
+async def remove_expired_members(subscriptions: list):
+    if not EXPIRY_KICK_FROM_CHANNEL:
+        return
+    with send_priority(PRIORITY_ADMIN):
+        await kick_from_channels(subscriptions)
+
+
+async def kick_from_channels(subscriptions: list):
+    for sub in subscriptions:
+        tariff = await tariff_catalog.get(sub["tariff_id"])
+        channel_id = tariff.get("channel_id") if tariff else None
+        if not channel_id:
+            continue
+
+        # Не трогаем пользователя, если у него есть другая активная подписка на этот канал
+        others = await active_subscriptions.list_active(sub["user_id"])
+        other_tariffs = await tariff_catalog.get_many(other["tariff_id"] for other in others)
+        if any(t.get("channel_id") == channel_id for t in other_tariffs.values()):
+            continue
+
+        try:
+            # ban + unban = удалить из канала без вечного бана
+            await bot.ban_chat_member(chat_id=channel_id, user_id=sub["user_id"])
+            await bot.unban_chat_member(chat_id=channel_id, user_id=sub["user_id"], only_if_banned=True)
+        except Exception as e:
+            logger.error("❌ Error removing user %s from channel %s: %s", sub["user_id"], channel_id, e)
+
+
+expiry.on_expired = on_subscriptions_expired
+
+
+# --- INVITE LINKS ---
+async def active_channel_ids() -> set:
+    # Запас ссылок держим для каналов всех активных тарифов
+    await tariff_catalog.ensure_fresh()
+    return {
+        tariff["channel_id"]
+        for tariff in tariff_catalog.by_id.values()
+        if tariff.get("channel_id") and tariff.get("is_active")
+    }
+
+
+invites.channels = active_channel_ids
+
+
+# --- BROADCASTS ---
+RENEWAL_REMINDER_TEXT = {
+    "ru": "⏰ Подписка «{title}» заканчивается {ends_at}.\nПродлите её, чтобы не потерять доступ 👇",
+    "en": "⏰ Your subscription “{title}” ends on {ends_at}.\nRenew it to keep your access 👇",
+}
+
+
+async def renewal_reminder_audience(params: dict, cursor, limit: int):
+    # Активные подписки с ends_at в окне (since, until], страницами по (ends_at, id)
+    rows = await db.subscriptions.list_active_ending_before(
+        params["until"], after=cursor, limit=limit, since=params["since"]
+    )
+    users = await db.users.get_many(row["user_id"] for row in rows)
+    tariffs = await tariff_catalog.get_many(row["tariff_id"] for row in rows)
+
+    messages = []
+    for row in rows:
+        tariff = tariffs.get(str(row["tariff_id"]))
+        if not tariff:
+            continue
+        user = users.get(str(row["user_id"]))
+        lang = "ru" if user and user.get("lang") == "ru" else "en"
+        messages.append({
+            "chat_id": row["user_id"],
+            "text": RENEWAL_REMINDER_TEXT[lang].format(
+                title=escape(tariff["title"]), ends_at=str(row["ends_at"])[:16].replace("T", " ")
+            ),
+            "reply_markup": get_plan_detail_keyboard(str(tariff["id"])),
+        })
+    next_cursor = [rows[-1]["ends_at"], rows[-1]["id"]] if len(rows) == limit else None
+    return messages, next_cursor
+
+
+async def tariff_announcement_audience(params: dict, cursor, limit: int):
+    # Пользователи категории/канала, страницами по id; text_ru — необязательный перевод
+    rows = await db.users.list_page(params.get("category"), params.get("channel"), after=cursor, limit=limit)
+    keyboard = get_plan_detail_keyboard(str(params["tariff_id"])) if params.get("tariff_id") else None
+    messages = [
+        {
+            "chat_id": row["id"],
+            "text": params.get(f"text_{row.get('lang')}") or params["text"],
+            "reply_markup": keyboard,
+        }
+        for row in rows
+    ]
+    next_cursor = rows[-1]["id"] if len(rows) == limit else None
+    return messages, next_cursor
+
+
+broadcasts.register("renewal_reminder", renewal_reminder_audience)
+broadcasts.register("tariff_announcement", tariff_announcement_audience)
+
+
+# --- PAYMENT WEBHOOKS ---
+async def tribute_webhook_handler(request: web.Request):
     try:
         raw_body = await request.read()
         data = json.loads(raw_body.decode('utf-8'))
         
-        print("📥 Tribute webhook received:", data)
+        # Полный payload — только на DEBUG: форматирование большого dict на каждый вебхук не бесплатно
+        logger.debug("📥 Tribute webhook received: %s", data)
         
         # Проверка подписи
         signature = request.headers.get("trbt-signature")
@@ -597,7 +1191,7 @@ async def tribute_webhook_handler(request: web.Request, bot: Bot):
             ).hexdigest()
             
             if not hmac.compare_digest(computed_signature, signature):
-                print("❌ Invalid Tribute signature")
+                logger.warning("❌ Invalid Tribute signature")
                 return web.json_response({"ok": False, "error": "Invalid signature"}, status=403)
         
         event_name = data.get("name")
@@ -606,141 +1200,32 @@ async def tribute_webhook_handler(request: web.Request, bot: Bot):
         
         if not telegram_user_id:
             return web.json_response({"ok": False, "error": "Missing telegram_user_id"}, status=400)
-        
-        supabase = request.app["supabase"]
-        
-        # Получаем язык пользователя из базы
-        user_resp = supabase.table("users") \
-            .select("lang") \
-            .eq("id", telegram_user_id) \
-            .execute()
-        
-        lang = "en"  # значение по умолчанию
-        if user_resp.data:
-            lang = user_resp.data[0].get("lang", "en")
-        
-        if event_name == "new_subscription":
-            subscription_id = payload.get("subscription_id")
-            subscription_name = payload.get("subscription_name")
-            expires_at = payload.get("expires_at")
-            
-            if not all([subscription_id, subscription_name, expires_at]):
-                error_msg = "Недостаточно данных" if lang == "ru" else "Missing required fields"
-                return web.json_response({"ok": False, "error": error_msg}, status=400)
-            
-            # Находим тариф по subscription_name (соответствует title в таблице тарифов)
-            tariff_resp = supabase.table("tariffs") \
-                .select("*") \
-                .eq("title", subscription_name) \
-                .limit(1) \
-                .execute()
-            
-            if not tariff_resp.data:
-                print(f"❌ Tariff not found for subscription_name: {subscription_name}")
-                error_msg = "Тариф не найден" if lang == "ru" else "Tariff not found"
-                return web.json_response({"ok": False, "error": error_msg}, status=404)
-            
-            tariff = tariff_resp.data[0]
-            tariff_id = tariff["id"]
-            channel_id = tariff.get("channel_id")
-            started_at = datetime.now(timezone.utc).isoformat()
-            
-            # Обновляем или создаем подписку
-            supabase.table("subscriptions").upsert({
-                "id": subscription_id,
-                "user_id": telegram_user_id,
-                "tariff_id": tariff_id,
-                "started_at": started_at,
-                "ends_at": expires_at,
-                "status": "active",
-                "price": payload.get("price"),
-                "currency": payload.get("currency"),
-                "updated_at": started_at
-            }).execute()
-            
-            # Формируем сообщения на нужном языке
-            if lang == "ru":
-                success_msg = (
-                    f"🎉 Подписка активирована!\n\n"
-                    f"📝 Тариф: {subscription_name}\n"
-                    f"💰 Стоимость: {payload.get('amount')} {payload.get('currency')}\n"
-                    f"⏳ Действует до: {expires_at}"
-                )
-                invite_msg = f"🔗 Ссылка для вступления: {{link}}"
-            else:
-                success_msg = (
-                    f"🎉 Subscription activated!\n\n"
-                    f"📝 Plan: {subscription_name}\n"
-                    f"💰 Amount: {payload.get('amount')} {payload.get('currency')}\n"
-                    f"⏳ Valid until: {expires_at}"
-                )
-                invite_msg = f"🔗 Invite link: {{link}}"
-            
-            # Отправляем сообщение пользователю
-            try:
-                await bot.send_message(chat_id=telegram_user_id, text=success_msg)
-                
-                # Если есть channel_id, создаем инвайт-ссылку
-                if channel_id:
-                    invite = await bot.create_chat_invite_link(
-                        chat_id=channel_id,
-                        member_limit=1
-                    )
-                    await bot.send_message(
-                        chat_id=telegram_user_id,
-                        text=invite_msg.format(link=invite.invite_link)
-                    )
-            except Exception as e:
-                print(f"❌ Error sending message: {e}")
-
-
-                    # Отправляем уведомление
-            now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-            notification_msg = (
-                "🆕 <b>New Tribute subscription</b>\n"
-                f"📅 <b>Date:</b> {now}\n"
-                f"👤 <b>User ID:</b> {telegram_user_id}\n"
-                f"📝 <b>Plan:</b> {subscription_name}\n"
-                f"💰 <b>Amount:</b> {payload.get('amount')} {payload.get('currency')}\n"
-                f"⏳ <b>Valid until:</b> {expires_at}"
-            )
-            await send_notification(notification_msg)
-
-            
-            
-            return web.json_response({"ok": True})
 
+        if event_name == "new_subscription":
+            required = [payload.get("subscription_id"), payload.get("subscription_name"), payload.get("expires_at")]
+            if not all(required):
+                return web.json_response({"ok": False, "error": "Missing required fields"}, status=400)
+        elif event_name != "cancelled_subscription":
+            return web.json_response({"ok": True, "message": "Event not processed"})
+
+        # Повторы того же события отсекаем ещё до очереди
+        # subscription_id у Tribute — продукт, а не пользователь: без user id оплаты двух людей склеились бы
+        event_key = (
+            f"tribute:{event_name}:{telegram_user_id}:{payload.get('subscription_id')}:{payload.get('expires_at')}"
+        )
+        if not idempotency.claim(event_key):
+            return web.json_response({"ok": True, "message": "Duplicate event"})
 
-        
-        elif event_name == "cancelled_subscription":
-            # Обработка отмены подписки с учетом языка
-            subscription_name = payload.get("subscription_name", "")
-            cancel_reason = payload.get("cancel_reason", "")
-            
-            if lang == "ru":
-                msg = (
-                    f"❌ Ваша подписка отменена\n\n"
-                    f"📝 Тариф: {subscription_name}\n"
-                    f"📌 Причина: {cancel_reason or 'не указана'}"
-                )
-            else:
-                msg = (
-                    f"❌ Your subscription has been cancelled\n\n"
-                    f"📝 Plan: {subscription_name}\n"
-                    f"📌 Reason: {cancel_reason or 'not specified'}"
-                )
-            
-            try:
-                await bot.send_message(chat_id=telegram_user_id, text=msg)
-            except Exception as e:
-                print(f"❌ Error sending cancellation message: {e}")
-            
-            return web.json_response({"ok": True})
-        
-        return web.json_response({"ok": True, "message": "Event not processed"})
+        # Сохраняем событие в локальную очередь и сразу отвечаем Tribute
+        try:
+            await request.app["jobs"].enqueue("tribute_event", data)
+        except Exception:
+            idempotency.release(event_key)
+            raise
+        return web.json_response({"ok": True})
     
     except Exception as e:
-        print(f"❌ Tribute webhook error: {e}")
+        logger.error("❌ Tribute webhook error: %s", e)
         return web.json_response({"ok": False, "error": str(e)}, status=500)
 
 
@@ -753,143 +1238,117 @@ async def crypto_webhook(request: web.Request):
         # invoice_id = data.get("invoice_id")
         # token = data.get("token")
         # Проверяем, что order_id принадлежит текущей реплике
-        bot_token_hash = hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:8]
-        if not order_id.endswith(f"-{bot_token_hash}"):
-            print(f"⚠️ Order {order_id} not for this replica. Redirecting to WEBHOOK_URL2...")
-            
-            if not WEBHOOK_URL2:
-                return web.json_response({"ok": False, "error": "WEBHOOK_URL2 not configured"}, status=500)
-            
+        if order_id and not router.owns(order_id):
+            hops = int(request.headers.get(HOP_HEADER, 0))
+            if hops >= router.max_hops:
+                logger.error("❌ Order %s bounced between replicas %s times, dropping.", order_id, hops)
+                return web.json_response({"ok": False, "error": "Too many replica hops"}, status=508)
+
+            target_url = router.route(order_id)
+            if not target_url:
+                logger.warning("⚠️ Order %s belongs to an unknown replica, dropping.", order_id)
+                return web.json_response({"ok": False, "error": "Unknown replica for this order"}, status=404)
+            logger.info("⚠️ Order %s not for this replica. Redirecting to %s...", order_id, target_url)
+
             try:
-                async with aiohttp.ClientSession() as session:
-                    # Пересылаем вебхук на вторую реплику
-                    resp = await session.post(
-                        f"{WEBHOOK_URL2}/webhook/cryptocloud",
-                        data=data,
-                        timeout=5
-                    )
-                    return web.json_response(await resp.json())
+                # Пересылаем вебхук реплике-владельцу
+                async with http.post(
+                    f"{target_url}/webhook/cryptocloud",
+                    data=data,
+                    headers={HOP_HEADER: str(hops + 1)},
+                    timeout=aiohttp.ClientTimeout(total=5)
+                ) as resp:
+                    return web.json_response(await resp.json(content_type=None), status=resp.status)
             except Exception as e:
-                print(f"❌ Error redirecting to WEBHOOK_URL2: {e}")
+                logger.error("❌ Error redirecting to %s: %s", target_url, e)
                 return web.json_response({"ok": False, "error": str(e)}, status=500)
         
         # Остальная логика обработки для текущей реплики
         if status != "success" or not order_id:
             return web.json_response({"ok": True, "msg": "Ignored non-success status"}, status=200)
 
+        # Повторы того же события отсекаем ещё до очереди
+        event_key = f"cryptocloud:{order_id}:{status}"
+        if not idempotency.claim(event_key):
+            return web.json_response({"ok": True, "msg": "Duplicate event"})
 
-        # Обновляем invoice
-        update_result = supabase.table("invoices") \
-            .update({
-                "status": "paid",
-                "paid_at": datetime.utcnow().isoformat(),
-                # "invoice_id": invoice_id,
-                # "token": token
-            }) \
-            .eq("order_id", order_id) \
-            .execute()
-
-        if not update_result.data:
-            print(f"⚠️ Invoice {order_id} not found in database.")
-            return web.json_response({"ok": False, "error": "Invoice not found"}, status=404)
-
-        print(f"✅ Invoice {order_id} marked as paid.")
-
-        # --- Получаем user_id, tariff_id из invoices ---
-        invoice = update_result.data[0]
-        user_id = invoice["user_id"]
-        tariff_id = invoice["tariff_id"]
-
-        # --- Получаем lang пользователя ---
-        user_resp = supabase.table("users").select("lang").eq("id", user_id).single().execute()
-        lang = user_resp.data["lang"] if user_resp.data else "en"
-
-        # --- Отправляем сообщение пользователю ---
+        # Сохраняем событие в локальную очередь и сразу отвечаем CryptoCloud
         try:
-            msg_text = "✅ Оплата прошла успешно!" if lang == "ru" else "✅ Payment successful!"
-            await bot.send_message(chat_id=user_id, text=msg_text)
-        except Exception as e:
-            print(f"❌ Error sending payment success message to user {user_id}: {e}")
-
-        # --- Получаем тариф для времени подписки и канала ---
-        tariff_resp = supabase.table("tariffs").select("lifetime", "channel_id", "title").eq("id", tariff_id).single().execute()
-        if not tariff_resp.data:
-            print(f"⚠️ Tariff {tariff_id} not found.")
-            return web.json_response({"ok": True})
-
-        tariff = tariff_resp.data
-        lifetime_min = int(tariff["lifetime"])
-        channel_id = tariff.get("channel_id")
-
-        started_at = datetime.utcnow()
-        ends_at = started_at + timedelta(minutes=lifetime_min)
-
-        # --- Создаем запись подписки ---
-        sub_id = str(uuid4())
-        supabase.table("subscriptions").insert({
-            "id": sub_id,
-            "user_id": user_id,
-            "tariff_id": tariff_id,
-            "order_id": order_id,
-            "started_at": started_at.isoformat(),
-            "ends_at": ends_at.isoformat(),
-            "status": "active",
-            "created_at": started_at.isoformat()
-            # "invoice_id": invoice_id
-        }).execute()
-
-        # --- Создаем invite ссылку для канала и отправляем ---
-        if channel_id:
-            try:
-                # Получаем уже существующую или создаем новую ссылку
-                invite = await bot.create_chat_invite_link(chat_id=channel_id, expire_date=None, member_limit=None)
-                invite_link = invite.invite_link
-                invite_msg = (
-                    f"📢 Вы получили доступ к каналу по подписке: {tariff['title']}\n\n"
-                    f"Ссылка для вступления: {invite_link}"
-                    if lang == "ru" else
-                    f"📢 You have been granted access to the channel for your subscription: {tariff['title']}\n\n"
-                    f"Invite link: {invite_link}"
-                )
-                await bot.send_message(chat_id=user_id, text=invite_msg)
-               
-            except Exception as e:
-                print(f"❌ Error creating or sending invite link for user {user_id}: {e}")
-
-
-        # Отправляем уведомление (ПРАВИЛЬНОЕ РАСПОЛОЖЕНИЕ)
-        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        notification_msg = (
-            "🆕 <b>New Crypto subscription</b>\n"
-            f"📅 <b>Date:</b> {now}\n"
-            f"👤 <b>User ID:</b> {user_id}\n"
-            f"📝 <b>Plan:</b> {tariff['title']}\n"
-            f"💰 <b>Amount:</b> {invoice['amount']} {invoice['currency']}\n"
-            f"⏳ <b>Valid until:</b> {ends_at.isoformat()}"
-        )
-        await send_notification(notification_msg)
-
+            await request.app["jobs"].enqueue("crypto_payment", dict(data))
+        except Exception:
+            idempotency.release(event_key)
+            raise
         return web.json_response({"ok": True})
 
     except Exception as e:
-        print("❌ Webhook error:", e)
+        logger.error("❌ Webhook error: %s", e)
         return web.json_response({"ok": False, "error": str(e)}, status=500)
 
 
 
 # --- APP SETUP ---
-app = web.Application(middlewares=[logging_middleware])  # ✅ подключаем middleware
-app["supabase"] = supabase
+app = web.Application(middlewares=[metrics_middleware, logging_middleware])  # ✅ подключаем middleware
+app["db"] = db
+app["log_writer"] = log_writer
+app["tariff_catalog"] = tariff_catalog
+app["user_cache"] = user_cache
+app["http"] = http
+app["notifier"] = notifier
+app["jobs"] = jobs
+app["expiry"] = expiry
+app["active_subscriptions"] = active_subscriptions
+app["invites"] = invites
+app["outbound"] = outbound
+app["broadcasts"] = broadcasts
+app["primary"] = True  # в режиме нескольких воркеров переопределяется в on_worker
+app["readiness"] = {"webhook": False}  # после старта app заморожен, меняем только содержимое
 
 dp["base_url"] = WEBHOOK_URL
-SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path="/webhook")
+# Апдейт подтверждаем сразу, обрабатываем из ограниченной очереди по порядку для каждого пользователя
+webhook_handler = QueuedRequestHandler(dispatcher=dp, bot=bot)
+updates = webhook_handler.queue
+app["updates"] = updates
+webhook_handler.register(app, path="/webhook")
 
 # Регистрируем CryptoCloud Webhook вручную
 app.router.add_post("/webhook/cryptocloud", crypto_webhook)
-app.router.add_post("/webhook/tribute", lambda r: tribute_webhook_handler(r, bot))
+app.router.add_post("/webhook/tribute", tribute_webhook_handler)
+app.router.add_get("/metrics", metrics_handler)
+app.router.add_get("/healthz", healthz_handler)
+app.router.add_get("/readyz", readyz_handler)
+if ADMIN_TOKEN:
+    app.router.add_post("/internal/tariffs/invalidate", invalidate_tariffs_handler)
+    app.router.add_get("/internal/cache/stats", cache_stats_handler)
+    app.router.add_get("/internal/jobs/stats", jobs_stats_handler)
+    app.router.add_post("/internal/broadcasts", create_broadcast_handler)
+    app.router.add_get("/internal/broadcasts", list_broadcasts_handler)
+    app.router.add_get(r"/internal/broadcasts/{id:\d+}", get_broadcast_handler)
+    app.router.add_post(r"/internal/broadcasts/{id:\d+}/cancel", cancel_broadcast_handler)
 
 app.on_startup.append(on_startup)
+# Раньше обработчика /webhook: он закрывает сессию бота, а фоновые задачи ещё могут в неё писать
+app.on_shutdown.insert(0, on_shutdown)
+app.on_cleanup.append(on_cleanup)
+
+def on_worker(index: int):
+    app["primary"] = index == 0
+
+
+def on_worker_exit(index: int, pid: int):
+    # Задачи, которые воркер взял и не доделал (платежи!), иначе висели бы в 'running' до рестарта сервиса
+    recovered = jobs.recover_interrupted(owner=pid)
+    if recovered:
+        logger.warning("♻️ Requeued %s jobs of worker %s (pid %s)", recovered, index, pid)
+
 
 if __name__ == "__main__":
     setup_application(app, dp, bot=bot)
-    web.run_app(app, host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+    port = int(os.getenv("PORT", 8080))
+    if MULTI_WORKER:
+        jobs.recover_interrupted()
+        run_workers(
+            app, host="0.0.0.0", port=port, workers=WEB_WORKERS,
+            on_worker=on_worker, on_worker_exit=on_worker_exit,
+        )
+    else:
+        web.run_app(app, host="0.0.0.0", port=port)
@@ -0,0 +1,258 @@
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+# Метрики в текстовом формате Prometheus, без внешних зависимостей
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels):
+        # Для счётчиков, которые ведёт сам объект (hits, accepted, ...): collector переносит их как есть
+        self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = entry[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        # collector — функция (или корутина), обновляющая метрики перед отдачей /metrics
+        self.collectors.append(collector)
+
+    async def collect(self):
+        for collector in self.collectors:
+            try:
+                result = collector()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error("❌ Metrics collector failed: %s", e)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# --- METRICS ---
+registry = Registry()
+
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "aiohttp route latency", ("route", "method", "status"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "HTTP requests being processed", ("route",))
+
+HANDLER_LATENCY = registry.histogram(
+    "aiogram_handler_duration_seconds", "aiogram handler latency", ("handler",))
+HANDLER_IN_FLIGHT = registry.gauge(
+    "aiogram_handlers_in_flight", "aiogram handlers being executed", ("handler",))
+
+SUPABASE_LATENCY = registry.histogram(
+    "supabase_request_duration_seconds", "PostgREST call latency", ("table", "operation"))
+TELEGRAM_LATENCY = registry.histogram(
+    "telegram_request_duration_seconds", "Telegram Bot API call latency", ("bot", "method"))
+CRYPTOCLOUD_LATENCY = registry.histogram(
+    "cryptocloud_request_duration_seconds", "CryptoCloud API call latency", ("endpoint",))
+
+ERRORS = registry.counter(
+    "errors_total", "Errors by component", ("component",))
+QUEUE_DEPTH = registry.gauge(
+    "queue_depth", "Items waiting in background queues", ("queue",))
+CACHE_EVENTS = registry.counter(
+    "cache_events_total", "Cache hits/misses/evictions", ("cache", "event"))
+UPDATE_EVENTS = registry.counter(
+    "telegram_update_events_total", "Webhook updates by ingestion outcome", ("event",))
+LOGS_DROPPED = registry.counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+# --- HELPERS ---
+SUPABASE_OPERATIONS = {"GET": "select", "POST": "insert", "PATCH": "update", "DELETE": "delete"}
+
+
+@contextmanager
+def track_supabase(query):
+    table = getattr(query, "path", "").strip("/") or "unknown"
+    operation = SUPABASE_OPERATIONS.get(getattr(query, "http_method", ""), "other")
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(component="supabase")
+        raise
+    finally:
+        SUPABASE_LATENCY.observe(time.perf_counter() - started, table=table, operation=operation)
+
+
+class TelegramMetricsMiddleware:
+    # Middleware сессии aiogram: время каждого вызова Bot API
+
+    def __init__(self, bot_name: str = "main"):
+        self.bot_name = bot_name
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            ERRORS.inc(component="telegram")
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, bot=self.bot_name, method=name)
+
+
+class HandlerMetricsMiddleware:
+    # Inner middleware aiogram: время работы конкретного хендлера
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        with HANDLER_IN_FLIGHT.track(handler=name):
+            try:
+                return await handler(event, data)
+            except Exception:
+                ERRORS.inc(component="aiogram")
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
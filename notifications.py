@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+
+import aiohttp
+
+from metrics import TELEGRAM_LATENCY, ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", 1000))
+NOTIFICATION_MIN_INTERVAL = float(os.getenv("NOTIFICATION_MIN_INTERVAL", 3))  # ~20 сообщений в минуту в группу
+NOTIFICATION_MAX_BATCH = int(os.getenv("NOTIFICATION_MAX_BATCH", 10))
+NOTIFICATION_MAX_RETRIES = int(os.getenv("NOTIFICATION_MAX_RETRIES", 5))
+NOTIFICATION_RETRY_DELAY = float(os.getenv("NOTIFICATION_RETRY_DELAY", 1))
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+SEPARATOR = "\n\n"
+
+
+class NotificationQueue:
+    # Уведомления админам: очередь + фоновый воркер, который склеивает события и соблюдает лимиты Telegram
+
+    def __init__(
+        self,
+        http,
+        token: str,
+        chat_id: str,
+        max_size: int = NOTIFICATION_QUEUE_SIZE,
+        min_interval: float = NOTIFICATION_MIN_INTERVAL,
+        max_batch: int = NOTIFICATION_MAX_BATCH,
+        max_retries: int = NOTIFICATION_MAX_RETRIES,
+        retry_delay: float = NOTIFICATION_RETRY_DELAY,
+        api_url: str = "https://api.telegram.org",
+    ):
+        self.http = http
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.max_size = max_size
+        self.min_interval = min_interval
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self._next_send_at = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, message: str):
+        if len(self._queue) >= self.max_size:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(message)
+        self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        if self._task is None:
+            if not self._queue:
+                return
+            # Уведомления от запросов, дорабатывавших после остановки, досылаем здесь
+            self._task = asyncio.create_task(self._run())
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ %s notifications were not delivered before shutdown", len(self._queue))
+        self._task = None
+
+    def _take_batch(self) -> str:
+        # Во время всплеска объединяем несколько событий в одно сообщение
+        parts = [self._queue.popleft()]
+        length = len(parts[0])
+        while self._queue and len(parts) < self.max_batch:
+            nxt = self._queue[0]
+            if length + len(SEPARATOR) + len(nxt) > TELEGRAM_MESSAGE_LIMIT:
+                break
+            parts.append(self._queue.popleft())
+            length += len(SEPARATOR) + len(nxt)
+        return SEPARATOR.join(parts)
+
+    async def _run(self):
+        while self._queue or not self._stopping:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Ждём окно rate limit'а — за это время очередь успевает накопиться
+            delay = self._next_send_at - time.monotonic()
+            if delay > 0 and not self._stopping:
+                await asyncio.sleep(delay)
+
+            text = self._take_batch()
+            if await self._send(text):
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._next_send_at = time.monotonic() + self.min_interval
+
+    async def _send(self, text: str) -> bool:
+        payload = {
+            "chat_id": self.chat_id,
+            "text": text,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True
+        }
+        for attempt in range(self.max_retries):
+            delay = self.retry_delay * 2 ** attempt
+            try:
+                with TELEGRAM_LATENCY.time(bot="notifications", method="sendMessage"):
+                    async with self.http.post(self.url, json=payload, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                        status = resp.status
+                        error_text = await resp.text()
+                if status == 200:
+                    return True
+                ERRORS.inc(component="notifications")
+                if status == 429:
+                    # Telegram сам говорит, сколько ждать
+                    try:
+                        delay = max(delay, float(json.loads(error_text)["parameters"]["retry_after"]))
+                    except Exception:
+                        pass
+                elif 400 <= status < 500:
+                    logger.error("❌ Notification rejected: %s", error_text)
+                    return False
+                if attempt == self.max_retries - 1:
+                    logger.error("❌ Final notification send failed: %s", error_text)
+                    return False
+            except Exception as e:
+                ERRORS.inc(component="notifications")
+                if attempt == self.max_retries - 1:
+                    logger.error("❌ Final notification error: %s", e)
+                    return False
+            await asyncio.sleep(delay)
+        return False
@@ -0,0 +1,203 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))  # запросов в секунду на бота
+TELEGRAM_GLOBAL_BURST = float(os.getenv("TELEGRAM_GLOBAL_BURST", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))  # личный чат: ~1 сообщение в секунду
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_GROUP_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_PER_MINUTE", 20))  # группы и каналы
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 3))
+TELEGRAM_CHAT_BUCKETS_MAX = int(os.getenv("TELEGRAM_CHAT_BUCKETS_MAX", 10000))
+
+# Меньше — раньше: ответы пользователю, затем служебные вызовы, затем рассылки
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+
+# Лимиты на чат Telegram считает по сообщениям; остальные вызовы идут только через глобальный bucket
+MESSAGE_METHOD_PREFIXES = ("send", "edit", "copy", "forward")
+
+_priority = ContextVar("telegram_priority", default=PRIORITY_USER)
+
+
+@contextmanager
+def send_priority(priority: int):
+    # Всё, что отправляется внутри блока (в том же task), уходит с этим приоритетом
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # Берём токен (можно в долг) и возвращаем, сколько ждать до его появления
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class OutboundScheduler:
+    # Middleware сессии aiogram: все вызовы Bot API с chat_id проходят через
+    # per-chat и глобальный token bucket; глобальные токены раздаются по приоритету.
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        global_burst: float = TELEGRAM_GLOBAL_BURST,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+        group_per_minute: float = TELEGRAM_GROUP_PER_MINUTE,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+        max_chats: int = TELEGRAM_CHAT_BUCKETS_MAX,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+
+        self._chats = {}     # chat_id -> TokenBucket
+        self._waiters = []   # (priority, seq, future)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+        self.sent = 0
+        self.rate_limited = 0
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        # Всё, что ещё ждёт, отпускаем без лимита — идёт остановка
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+            private = isinstance(chat_id, int) and chat_id > 0
+            if private:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id, priority: int, seq: int):
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if self._task is None:
+            return  # до старта и после остановки глобальный лимит не держим
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, seq, future))
+        self._wakeup.set()
+        await future
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getMe, setWebhook, answerCallbackQuery — без очереди
+            return await make_request(bot, method)
+
+        name = method.__api_method__
+        chat_key = chat_id if name.startswith(MESSAGE_METHOD_PREFIXES) else None
+        priority = _priority.get()
+        seq = next(self._seq)  # при повторе после 429 запрос сохраняет своё место в очереди
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_key, priority, seq)
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                self.rate_limited += 1
+                self.global_bucket.pause(e.retry_after)
+                if chat_key is not None:
+                    self._chat_bucket(chat_key).pause(e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("⚠️ Telegram 429 on %s to %s, retry in %ss", name, chat_id, e.retry_after)
+
+    async def _run(self):
+        while not self._stopping:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self.global_bucket.reserve()
+            deadline = time.monotonic() + delay
+            while delay > 0 and not self._stopping:
+                # Спим до токена, но просыпаемся на stop()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = deadline - time.monotonic()
+
+            # Пока ждали токен, мог прийти запрос с более высоким приоритетом — он и получит слот
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                self.global_bucket.refund()
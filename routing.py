@@ -0,0 +1,65 @@
+import os
+import hashlib
+from typing import Optional
+
+
+# --- SETTINGS ---
+# Формат: "<suffix>=<url>,<suffix>=<url>", где suffix — первые 8 символов sha256(BOT_TOKEN) реплики
+REPLICA_URLS = os.getenv("REPLICA_URLS", "")
+REPLICA_MAX_HOPS = int(os.getenv("REPLICA_MAX_HOPS", 2))
+
+HOP_HEADER = "X-Replica-Hops"
+
+
+def token_suffix(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:8]
+
+
+def parse_replicas(value: str) -> dict:
+    replicas = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        suffix, _, url = item.partition("=")
+        if not url:
+            raise ValueError(f"Invalid REPLICA_URLS entry: {item!r}")
+        replicas[suffix.strip()] = url.strip().rstrip("/")
+    return replicas
+
+
+class ReplicaRouter:
+    # Куда отправить вебхук CryptoCloud по суффиксу order_id
+
+    def __init__(
+        self,
+        own_suffix: str,
+        replicas: dict,
+        fallback_url: Optional[str] = None,
+        max_hops: int = REPLICA_MAX_HOPS,
+    ):
+        self.own_suffix = own_suffix
+        self.max_hops = max_hops
+        # Себя в таблицу не включаем, чтобы не переслать вебхук самому себе
+        self.replicas = {suffix: url for suffix, url in replicas.items() if suffix != own_suffix}
+        # Старая схема из двух реплик: без REPLICA_URLS всё чужое уходит на WEBHOOK_URL2
+        self.fallback_url = fallback_url if not replicas else None
+
+    @classmethod
+    def from_env(cls, bot_token: str, fallback_url: Optional[str] = None) -> "ReplicaRouter":
+        return cls(token_suffix(bot_token), parse_replicas(REPLICA_URLS), fallback_url)
+
+    @staticmethod
+    def suffix_of(order_id: str) -> str:
+        return order_id.rsplit("-", 1)[-1]
+
+    def make_order_id(self, *parts) -> str:
+        return "-".join([*(str(part) for part in parts), self.own_suffix])
+
+    def owns(self, order_id: str) -> bool:
+        return self.suffix_of(order_id) == self.own_suffix
+
+    def route(self, order_id: str) -> Optional[str]:
+        # None — заказ не принадлежит ни одной известной реплике. Угадывать цель нельзя:
+        # у каждой реплики своя таблица (без себя), и вебхук ходил бы по кругу до лимита переходов
+        return self.replicas.get(self.suffix_of(order_id)) or self.fallback_url
@@ -0,0 +1,162 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+EXPIRY_HORIZON = float(os.getenv("EXPIRY_HORIZON", 6 * 3600))  # сколько секунд вперёд держим в куче
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", 100))
+EXPIRY_PAGE_SIZE = int(os.getenv("EXPIRY_PAGE_SIZE", 1000))
+EXPIRY_RELOAD_INTERVAL = float(os.getenv("EXPIRY_RELOAD_INTERVAL", EXPIRY_HORIZON / 2))
+
+
+def parse_timestamp(value) -> float:
+    # В базе лежат и naive-даты из utcnow(), и ISO-строки от Tribute с "Z"
+    dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class ExpiryScheduler:
+    # Переводит подписки в expired ровно тогда, когда наступает ends_at.
+    # Ближайшие сроки лежат в min-heap, задача спит до первого из них.
+
+    def __init__(
+        self,
+        repository,
+        on_expired=None,
+        horizon: float = EXPIRY_HORIZON,
+        batch_size: int = EXPIRY_BATCH_SIZE,
+        page_size: int = EXPIRY_PAGE_SIZE,
+        reload_interval: float = EXPIRY_RELOAD_INTERVAL,
+    ):
+        self.repository = repository
+        self.on_expired = on_expired
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.page_size = page_size
+        # Подписки, созданные в других процессах, попадают в кучу только при перечитывании базы
+        self.reload_interval = min(reload_interval, horizon / 2)
+
+        self._heap = []          # (ends_at, subscription_id)
+        self._deadlines = {}     # subscription_id -> актуальный ends_at (для ленивого удаления из кучи)
+        self._loaded_until = 0.0
+        self._loaded_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, subscription: dict):
+        # Новые и продлённые подписки; всё, что дальше горизонта, подгрузится позже
+        ends_at = parse_timestamp(subscription["ends_at"])
+        if ends_at > self._loaded_until:
+            return
+        subscription_id = str(subscription["id"])
+        if self._deadlines.get(subscription_id) == ends_at:
+            return
+        self._deadlines[subscription_id] = ends_at
+        heapq.heappush(self._heap, (ends_at, subscription_id))
+        if self._heap[0][1] == subscription_id:
+            self._wakeup.set()
+
+    def unschedule(self, subscription_id):
+        self._deadlines.pop(str(subscription_id), None)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def load(self):
+        # Подгружаем активные подписки, у которых ends_at попадает в горизонт (keyset-пагинация)
+        until = time.time() + self.horizon
+        until_iso = datetime.fromtimestamp(until, timezone.utc).isoformat()
+        cursor = None
+        while True:
+            rows = await self.repository.list_active_ending_before(until_iso, after=cursor, limit=self.page_size)
+            for row in rows:
+                ends_at = parse_timestamp(row["ends_at"])
+                subscription_id = str(row["id"])
+                if self._deadlines.get(subscription_id) != ends_at:
+                    self._deadlines[subscription_id] = ends_at
+                    heapq.heappush(self._heap, (ends_at, subscription_id))
+            if len(rows) < self.page_size:
+                break
+            cursor = (rows[-1]["ends_at"], rows[-1]["id"])
+        self._loaded_until = until
+        self._loaded_at = time.time()
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            ends_at, subscription_id = heapq.heappop(self._heap)
+            if self._deadlines.get(subscription_id) != ends_at:
+                continue  # запись устарела: подписку продлили или сняли с расписания
+            del self._deadlines[subscription_id]
+            due.append((ends_at, subscription_id))
+        return due
+
+    async def _expire(self, due: list):
+        try:
+            rows = await self.repository.expire([subscription_id for _, subscription_id in due])
+        except Exception:
+            # Возвращаем в кучу, чтобы повторить после паузы
+            for ends_at, subscription_id in due:
+                self._deadlines.setdefault(subscription_id, ends_at)
+                heapq.heappush(self._heap, (ends_at, subscription_id))
+            raise
+        self.expired += len(rows)
+        if rows:
+            logger.info("⌛ Expired %s subscriptions", len(rows))
+        if rows and self.on_expired:
+            try:
+                await self.on_expired(rows)
+            except Exception as e:
+                logger.error("❌ Error in expiry callback: %s", e)
+
+    async def _run(self):
+        while not self._stopping:
+            now = time.time()
+            try:
+                # Перечитываем базу раз в reload_interval (по умолчанию — когда горизонт наполовину пройден)
+                if now >= self._loaded_at + self.reload_interval:
+                    await self.load()
+
+                due = self._pop_due(now)
+                if due:
+                    await self._expire(due)
+                    continue
+            except Exception as e:
+                logger.error("❌ Expiry scheduler error: %s", e)
+                await asyncio.sleep(5)
+                continue
+
+            next_deadline = self._heap[0][0] if self._heap else float("inf")
+            next_reload = self._loaded_at + self.reload_interval
+            delay = max(0.0, min(next_deadline, next_reload) - time.time())
+
+            if self._stopping:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
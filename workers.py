@@ -0,0 +1,107 @@
+import os
+import time
+import signal
+import logging
+
+from aiohttp import web
+
+from logs import stop_logging
+
+logger = logging.getLogger(__name__)
+
+
+# --- SETTINGS ---
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", 70))  # после — SIGKILL
+WORKER_RESPAWN_DELAY = float(os.getenv("WORKER_RESPAWN_DELAY", 1))
+
+
+def run_workers(
+    app: web.Application, host: str, port: int, workers: int = WEB_WORKERS, on_worker=None, on_worker_exit=None,
+):
+    # Форкаем N процессов aiohttp на одном порту (SO_REUSEPORT): ядро само раскидывает соединения.
+    # Родитель только следит за детьми: перезапускает упавших и передаёт им SIGTERM/SIGINT.
+    # on_worker(index) вызывается в дочернем процессе до старта приложения,
+    # on_worker_exit(index, pid) — в родителе после смерти воркера, до перезапуска.
+    children = {}  # pid -> index
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            # Своя группа процессов: Ctrl+C в терминале получает только родитель и рассылает SIGTERM сам
+            os.setpgrp()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                if on_worker is not None:
+                    on_worker(index)
+                web.run_app(
+                    app, host=host, port=port, reuse_port=True,
+                    print=print if index == 0 else None,
+                )
+            except BaseException:
+                logger.exception("❌ Worker %s crashed", index)
+                code = 1
+            finally:
+                # os._exit() не вызывает atexit — дописываем очередь логов сами
+                stop_logging()
+                os._exit(code)
+        children[pid] = index
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info("🛑 Stopping %s workers (%s)", len(children), signal.Signals(signum).name)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(workers):
+        spawn(index)
+    logger.info("🚀 Started %s workers on %s:%s", workers, host, port)
+
+    deadline = None
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if stopping:
+                if deadline is None:
+                    deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+                elif time.monotonic() > deadline:
+                    logger.warning("⚠️ Workers did not stop in %ss, killing", WORKER_SHUTDOWN_TIMEOUT)
+                    for pid in children:
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    deadline = float("inf")
+            time.sleep(0.2)
+            continue
+
+        index = children.pop(pid, None)
+        if index is None:
+            continue
+        if on_worker_exit is not None:
+            try:
+                on_worker_exit(index, pid)
+            except Exception:
+                logger.exception("❌ on_worker_exit failed for worker %s", index)
+        if stopping:
+            continue
+        # Упавший воркер поднимаем с тем же номером: 0-й снова возьмёт на себя singleton-задачи
+        logger.error("❌ Worker %s (pid %s) exited with status %s, restarting", index, pid, os.waitstatus_to_exitcode(status))
+        time.sleep(WORKER_RESPAWN_DELAY)
+        if not stopping:
+            spawn(index)